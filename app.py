@@ -6,6 +6,7 @@ from modules.authentication import authenticate_user
 from modules.liveness_detection import check_liveness
 from modules.face_recognition import save_face_embedding, extract_face_embedding
 from modules.fingerprint_recognition import save_fingerprint_template
+from modules.image_context import ImageContext
 import os
 
 # Page configuration
@@ -140,13 +141,13 @@ else:
                 st.warning("⚠️ Please provide at least one biometric input")
             else:
                 with st.spinner("Verifying..."):
+                    # Decode each image once; liveness and verification share it
+                    face_img = ImageContext(face_img) if face_img else None
+                    fingerprint_img = ImageContext(fingerprint_img) if fingerprint_img else None
+                    
                     # Liveness check for face
                     if face_img:
-                        image = Image.open(face_img)
-                        img_array = np.array(image)
-                        img_bgr = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
-                        
-                        is_live = check_liveness(img_bgr)
+                        is_live = check_liveness(face_img)
                         if not is_live:
                             st.error("🚨 Liveness check failed! Face appears to be spoofed.")
                             st.stop()
@@ -251,13 +252,13 @@ else:
                 st.warning("⚠️ Please provide at least one authentication factor")
             else:
                 with st.spinner("Verifying all factors..."):
+                    # Decode each image once; liveness and verification share it
+                    face_mfa = ImageContext(face_mfa) if face_mfa else None
+                    fingerprint_mfa = ImageContext(fingerprint_mfa) if fingerprint_mfa else None
+                    
                     # Liveness check
                     if face_mfa:
-                        image = Image.open(face_mfa)
-                        img_array = np.array(image)
-                        img_bgr = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
-                        
-                        is_live = check_liveness(img_bgr)
+                        is_live = check_liveness(face_mfa)
                         if not is_live:
                             st.error("🚨 Liveness check failed!")
                             st.stop()
@@ -6,9 +6,10 @@ __author__ = "Biometric Auth System"
 
 # Import main functions for easier access
 from .authentication import authenticate_user, authenticate_user_simple
-from .face_recognition import verify_face, save_face_embedding, load_face_embedding
-from .fingerprint_recognition import verify_fingerprint, save_fingerprint_template, load_fingerprint_template
-from .liveness_detection import check_liveness
+from .face_recognition import verify_face, identify_face, save_face_embedding, load_face_embedding
+from .fingerprint_recognition import (verify_fingerprint, identify_fingerprint,
+                                      save_fingerprint_template, load_fingerprint_template)
+from .liveness_detection import check_liveness, check_liveness_video
 from .utils import verify_password
 from .settings import FACE_THRESHOLD, FINGERPRINT_THRESHOLD
 
@@ -16,8 +17,11 @@ __all__ = [
     'authenticate_user',
     'authenticate_user_simple',
     'verify_face',
+    'identify_face',
     'verify_fingerprint',
+    'identify_fingerprint',
     'check_liveness',
+    'check_liveness_video',
     'verify_password',
     'save_face_embedding',
     'load_face_embedding',
@@ -1,93 +1,230 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from modules.face_recognition import verify_face
 from modules.fingerprint_recognition import verify_fingerprint
 from modules.utils import verify_password
-from modules.settings import FACE_THRESHOLD, FINGERPRINT_THRESHOLD
+from modules.settings import (FACE_THRESHOLD, FINGERPRINT_THRESHOLD, AUTH_PARALLEL_FACTORS, AUTH_MAX_WORKERS,
+                              AUTH_EARLY_TERMINATION, AUTH_FACTOR_COST_MS)
+
+# Factors in the order they are reported in the result
+FACTORS = ('face', 'fingerprint', 'password')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    """Process-wide thread pool for factor evaluation (AUTH_MAX_WORKERS threads)"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=AUTH_MAX_WORKERS, thread_name_prefix="auth-factor")
+    return _executor
+
+def _evaluate_face(face_img, user_id):
+    """Face factor outcome: passed, detail string, scores and metrics"""
+    try:
+        face_ok, face_similarity = verify_face(face_img, threshold=FACE_THRESHOLD, user_id=user_id)
+    except Exception as e:
+        return {'passed': False, 'detail': f'error: {str(e)}', 'scores': {'face_similarity': 0.0}}
+    
+    if face_ok:
+        detail = f'verified (similarity: {face_similarity:.4f})'
+    else:
+        detail = f'failed (similarity: {face_similarity:.4f}, threshold: {FACE_THRESHOLD})'
+    return {'passed': face_ok, 'detail': detail, 'scores': {'face_similarity': round(face_similarity, 4)}}
+
+def _evaluate_fingerprint(fingerprint_img, user_id):
+    """Fingerprint factor outcome, with the matcher's breakdown as metrics"""
+    try:
+        finger_ok, fingerprint_score, match_details = verify_fingerprint(
+            fingerprint_img, threshold=FINGERPRINT_THRESHOLD, user_id=user_id, return_details=True
+        )
+    except Exception as e:
+        return {'passed': False, 'detail': f'error: {str(e)}', 'scores': {'fingerprint_match': 0.0}}
+    
+    if finger_ok:
+        detail = f'verified (match: {fingerprint_score:.4f})'
+    else:
+        detail = f'failed (match: {fingerprint_score:.4f}, threshold: {FINGERPRINT_THRESHOLD})'
+    if match_details.get('reenroll'):
+        detail += '; template was extracted with other settings, re-enroll to use the current ones'
+    return {
+        'passed': finger_ok,
+        'detail': detail,
+        'scores': {'fingerprint_match': round(fingerprint_score, 4)},
+        # Extraction, alignment and scoring cost (retries reported separately)
+        'metrics': {
+            key: round(value, 3) if isinstance(value, float) else value
+            for key, value in match_details.items()
+        }
+    }
+
+def _evaluate_password(password, user_id):
+    """Password factor outcome"""
+    try:
+        pwd_ok = verify_password(password)
+    except Exception as e:
+        return {'passed': False, 'detail': f'error: {str(e)}'}
+    return {'passed': pwd_ok, 'detail': 'verified' if pwd_ok else 'failed'}
+
+_EVALUATORS = {
+    'face': _evaluate_face,
+    'fingerprint': _evaluate_fingerprint,
+    'password': _evaluate_password
+}
+
+# Expected cost per factor (ms), seeded from settings and tracked from observed timings
+_expected_cost = dict(AUTH_FACTOR_COST_MS)
+_expected_cost_lock = threading.Lock()
+
+def _timed(name, value, user_id):
+    """Run one factor evaluator, adding its wall-clock time in ms"""
+    start = time.perf_counter()
+    outcome = _EVALUATORS[name](value, user_id)
+    outcome['elapsed_ms'] = round((time.perf_counter() - start) * 1000, 3)
+    with _expected_cost_lock:
+        _expected_cost[name] = 0.8 * _expected_cost[name] + 0.2 * outcome['elapsed_ms']
+    return outcome
+
+def schedule_factors(factors):
+    """Factors ordered cheapest first by expected cost"""
+    with _expected_cost_lock:
+        return sorted(factors, key=lambda name: _expected_cost[name])
+
+def _decided(outcomes, require_all, require_biometric):
+    """
+    True once the evaluated outcomes fix the result whatever the remaining
+    factors return: a failure under require_all, a passing biometric under
+    require_biometric, or any passing factor in any-factor mode
+    """
+    if require_all:
+        return any(not outcome['passed'] for outcome in outcomes.values())
+    if require_biometric:
+        return any(outcomes[name]['passed'] for name in ('face', 'fingerprint') if name in outcomes)
+    return any(outcome['passed'] for outcome in outcomes.values())
+
+def _run_sequential(order, inputs, user_id, should_stop):
+    """
+    Evaluate factors one by one, stopping as soon as should_stop(outcomes);
+    factors after the deciding one are never started
+
+    Returns:
+        (outcomes, decided_by): outcome per evaluated factor and the factor
+        that made should_stop true (None if it never did)
+    """
+    outcomes = {}
+    for name in order:
+        outcomes[name] = _timed(name, inputs[name], user_id)
+        if should_stop(outcomes):
+            return outcomes, name
+    return outcomes, None
+
+def _run_parallel(order, inputs, user_id, should_stop):
+    """
+    Evaluate every factor concurrently on the shared pool (submitted
+    cheapest first); once should_stop(outcomes) holds, queued factors are
+    cancelled and running ones are no longer waited for
+
+    Returns:
+        (outcomes, decided_by) as for _run_sequential
+    """
+    executor = get_executor()
+    futures = {executor.submit(_timed, name, inputs[name], user_id): name for name in order}
+    outcomes = {}
+    decided_by = None
+    pending = set(futures)
+    while pending and decided_by is None:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        # Factors finishing together are added in schedule order, so the one
+        # that settles the decision is well defined
+        for future in sorted(done, key=lambda future: order.index(futures[future])):
+            outcomes[futures[future]] = future.result()
+            if decided_by is None and should_stop(outcomes):
+                decided_by = futures[future]
+    for future in pending:
+        future.cancel()
+    return outcomes, decided_by
 
 def authenticate_user(face_img, fingerprint_img, password, user_id="default_user", 
-                      require_all=False, require_biometric=True):
+                      require_all=False, require_biometric=True, parallel=None, early_stop=None):
     """
     Multi-modal authentication with flexible verification modes
     
     Args:
-        face_img: Face image for verification
-        fingerprint_img: Fingerprint image for verification
+        face_img: Face image for verification (may be an ImageContext)
+        fingerprint_img: Fingerprint image for verification (may be an ImageContext)
         password: Password string for verification
         user_id: User identifier for database lookup
         require_all: If True, all provided factors must pass
         require_biometric: If True, at least one biometric must pass
+        parallel: Evaluate the provided factors concurrently on the shared
+                  thread pool (default: AUTH_PARALLEL_FACTORS)
+        early_stop: Skip the remaining factors once the decision cannot
+                    change (default: AUTH_EARLY_TERMINATION)
+    
+    Factors are scheduled cheapest first (password, face, fingerprint by
+    default; see AUTH_FACTOR_COST_MS). Factors left out by early
+    termination are listed in 'factors_skipped' and metrics['decided_by']
+    names the factor that settled the decision. In parallel mode skipped
+    factors may already have started (they are not waited for); in
+    sequential mode they never run.
     
     Returns:
-        dict with authentication result, details, and similarity scores
+        dict with authentication result, details, and similarity scores;
+        metrics['timings_ms'] holds the wall-clock time of each factor and
+        the 'total' latency
     """
     result = {
         'authenticated': False,
         'factors_passed': [],
         'factors_failed': [],
+        'factors_skipped': [],
         'details': {},
-        'scores': {}  # NEW: Store similarity/match scores
+        'scores': {},  # NEW: Store similarity/match scores
+        'metrics': {}  # Per-factor timing/diagnostics
     }
+    start = time.perf_counter()
+    
+    # Provided factors (an empty password is not provided), cheapest first
+    inputs = {'face': face_img, 'fingerprint': fingerprint_img, 'password': password or None}
+    order = schedule_factors([name for name in FACTORS if inputs[name] is not None])
+    
+    early_stop = AUTH_EARLY_TERMINATION if early_stop is None else early_stop
     
-    # Track which factors were attempted
-    factors_attempted = []
+    def should_stop(outcomes):
+        return early_stop and _decided(outcomes, require_all, require_biometric)
+    
+    # Face and fingerprint pipelines are independent (and mostly outside the GIL)
+    if AUTH_PARALLEL_FACTORS if parallel is None else parallel:
+        outcomes, decided_by = _run_parallel(order, inputs, user_id, should_stop)
+    else:
+        outcomes, decided_by = _run_sequential(order, inputs, user_id, should_stop)
+    
+    factors_attempted = [name for name in FACTORS if name in outcomes]
     factors_passed = []
+    result['factors_skipped'] = [name for name in FACTORS if name in order and name not in outcomes]
+    for name in result['factors_skipped']:
+        result['details'][name] = 'skipped (decision already made)'
+    if result['factors_skipped']:
+        result['metrics']['decided_by'] = decided_by
     
-    # 1. Face Verification
-    if face_img is not None:
-        factors_attempted.append('face')
-        try:
-            face_ok, face_similarity = verify_face(face_img, threshold=FACE_THRESHOLD, user_id=user_id)
-            
-            # Store the similarity score
-            result['scores']['face_similarity'] = round(face_similarity, 4)
-            
-            if face_ok:
-                factors_passed.append('face')
-                result['factors_passed'].append('face')
-                result['details']['face'] = f'verified (similarity: {face_similarity:.4f})'
-            else:
-                result['factors_failed'].append('face')
-                result['details']['face'] = f'failed (similarity: {face_similarity:.4f}, threshold: {FACE_THRESHOLD})'
-        except Exception as e:
-            result['factors_failed'].append('face')
-            result['details']['face'] = f'error: {str(e)}'
-            result['scores']['face_similarity'] = 0.0
-    
-    # 2. Fingerprint Verification
-    if fingerprint_img is not None:
-        factors_attempted.append('fingerprint')
-        try:
-            finger_ok, fingerprint_score = verify_fingerprint(fingerprint_img, threshold=FINGERPRINT_THRESHOLD, user_id=user_id)
-            
-            # Store the match score
-            result['scores']['fingerprint_match'] = round(fingerprint_score, 4)
-            
-            if finger_ok:
-                factors_passed.append('fingerprint')
-                result['factors_passed'].append('fingerprint')
-                result['details']['fingerprint'] = f'verified (match: {fingerprint_score:.4f})'
-            else:
-                result['factors_failed'].append('fingerprint')
-                result['details']['fingerprint'] = f'failed (match: {fingerprint_score:.4f}, threshold: {FINGERPRINT_THRESHOLD})'
-        except Exception as e:
-            result['factors_failed'].append('fingerprint')
-            result['details']['fingerprint'] = f'error: {str(e)}'
-            result['scores']['fingerprint_match'] = 0.0
-    
-    # 3. Password Verification (Fallback)
-    if password:
-        factors_attempted.append('password')
-        try:
-            pwd_ok = verify_password(password)
-            if pwd_ok:
-                factors_passed.append('password')
-                result['factors_passed'].append('password')
-                result['details']['password'] = 'verified'
-            else:
-                result['factors_failed'].append('password')
-                result['details']['password'] = 'failed'
-        except Exception as e:
-            result['factors_failed'].append('password')
-            result['details']['password'] = f'error: {str(e)}'
+    # Merge in the fixed factor order so the result does not depend on timing
+    timings = {}
+    for name in factors_attempted:
+        outcome = outcomes[name]
+        result['scores'].update(outcome.get('scores', {}))
+        if 'metrics' in outcome:
+            result['metrics'][name] = outcome['metrics']
+        timings[name] = outcome['elapsed_ms']
+        
+        if outcome['passed']:
+            factors_passed.append(name)
+            result['factors_passed'].append(name)
+        else:
+            result['factors_failed'].append(name)
+        result['details'][name] = outcome['detail']
     
     # Determine authentication result based on mode
     if require_all:
@@ -114,6 +251,8 @@ def authenticate_user(face_img, fingerprint_img, password, user_id="default_user
     # Summary
     result['factors_attempted'] = len(factors_attempted)
     result['factors_passed_count'] = len(factors_passed)
+    timings['total'] = round((time.perf_counter() - start) * 1000, 3)
+    result['metrics']['timings_ms'] = timings
     
     return result
 
@@ -121,9 +260,12 @@ def authenticate_user_simple(face_img, fingerprint_img, password, user_id="defau
     """
     Simplified authentication - returns True/False
     Requires: (face AND fingerprint) OR password
+    
+    Runs without early termination: any-factor mode would otherwise stop
+    after the first passing biometric.
     """
     result = authenticate_user(face_img, fingerprint_img, password, user_id, 
-                              require_biometric=False)
+                              require_biometric=False, early_stop=False)
     
     # Check if both biometrics passed
     if 'face' in result['factors_passed'] and 'fingerprint' in result['factors_passed']:
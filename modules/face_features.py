@@ -0,0 +1,82 @@
+import threading
+import cv2
+import numpy as np
+
+# Normalized face crop fed to the descriptors
+FACE_SIZE = (100, 100)
+
+# Intensity histograms over a REGIONS x REGIONS grid, HISTOGRAM_BINS bins each
+REGIONS = 8
+HISTOGRAM_BINS = 16
+
+class FaceFeatureExtractor:
+    """
+    HOG + regional intensity histogram features for face crops
+
+    The HOG descriptor and the pixel -> histogram-slot lookup are built
+    once and reused for every face. All REGIONS x REGIONS histograms come
+    from a single bincount, and features are written straight into a
+    float32 row, so a batch of crops fills one preallocated (N, D) matrix.
+    Features are identical to the original per-call HOGDescriptor and
+    calcHist loop.
+    """
+
+    def __init__(self):
+        width, height = FACE_SIZE
+        self._hog = cv2.HOGDescriptor(FACE_SIZE, (20, 20), (10, 10), (10, 10), 9)
+        self.hog_size = self._hog.getDescriptorSize()
+        self.dim = self.hog_size + REGIONS * REGIONS * HISTOGRAM_BINS
+
+        # Histogram slot of every pixel of the covered area, minus its bin;
+        # pixels past the last full region are ignored, as with calcHist
+        region_h, region_w = height // REGIONS, width // REGIONS
+        self._region_h, self._region_w = region_h * REGIONS, region_w * REGIONS
+        rows = np.arange(self._region_h) // region_h
+        cols = np.arange(self._region_w) // region_w
+        self._slots = ((rows[:, None] * REGIONS + cols[None, :]) * HISTOGRAM_BINS).astype(np.intp)
+        self._index = np.empty_like(self._slots)
+        self._lock = threading.Lock()
+
+    def normalize(self, face):
+        """Grayscale, FACE_SIZE and histogram-equalized copy of a face crop"""
+        if face.ndim == 3:
+            face = cv2.cvtColor(face, cv2.COLOR_BGR2GRAY)
+        return cv2.equalizeHist(cv2.resize(face, FACE_SIZE))
+
+    def extract(self, face, out=None):
+        """
+        Feature vector of one face crop (grayscale or BGR, any size)
+
+        Args:
+            out: Optional float32 array of length dim to write into
+
+        Returns:
+            L2-normalized float32 vector of length dim
+        """
+        if out is None:
+            out = np.empty(self.dim, np.float32)
+        normalized = self.normalize(face)
+
+        with self._lock:
+            out[:self.hog_size] = self._hog.compute(normalized).ravel()
+
+            bins = normalized[:self._region_h, :self._region_w] // (256 // HISTOGRAM_BINS)
+            np.add(self._slots, bins, out=self._index)
+            out[self.hog_size:] = np.bincount(self._index.ravel(), minlength=self.dim - self.hog_size)
+
+        out /= np.linalg.norm(out) + 1e-7
+        return out
+
+    def extract_batch(self, faces):
+        """
+        Feature matrix for a sequence of face crops
+
+        Returns:
+            (N, dim) float32 matrix, one L2-normalized row per crop
+        """
+        features = np.empty((len(faces), self.dim), np.float32)
+        for row, face in enumerate(faces):
+            self.extract(face, out=features[row])
+        return features
+
+face_feature_extractor = FaceFeatureExtractor()
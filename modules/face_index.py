@@ -0,0 +1,591 @@
+import os
+import json
+import time
+import threading
+import numpy as np
+from modules.settings import (FACE_GALLERY_PATH, FACE_EMBEDDING_DTYPE,
+                              FACE_ANN_PATH, FACE_ANN_NPROBE, FACE_ANN_MIN_USERS)
+
+# Storage types for face embeddings; int8 carries one float32 scale per vector
+EMBEDDING_DTYPES = ('float32', 'float16', 'int8')
+
+# Rows converted to float32 per matrix multiply when scanning a quantized gallery
+_SCAN_BLOCK = 8192
+
+def quantize_embeddings(vectors, dtype):
+    """
+    Convert float embeddings (1-D or (N, D)) to a storage dtype
+
+    Returns:
+        (codes, scales): scales is None except for int8, where each vector is
+        stored as round(v / scale) with scale = max|v| / 127
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if dtype in ('float32', 'float16'):
+        return vectors.astype(dtype), None
+    if dtype != 'int8':
+        raise ValueError(f"Unknown embedding dtype: {dtype} (expected one of {EMBEDDING_DTYPES})")
+
+    scales = np.abs(vectors).max(axis=-1) / 127.0
+    scales = np.maximum(scales, np.float32(1e-12)).astype(np.float32)
+    codes = np.rint(vectors / np.expand_dims(scales, -1)).astype(np.int8)
+    return codes, scales
+
+def dequantize_embeddings(codes, scales=None):
+    """Inverse of quantize_embeddings, returning float32"""
+    vectors = np.asarray(codes).astype(np.float32)
+    if scales is not None:
+        vectors *= np.expand_dims(np.asarray(scales, np.float32), -1)
+    return vectors
+
+class FaceGallery:
+    """
+    All enrolled face embeddings as one L2-normalized matrix
+
+    The matrix lives in a memory-mapped .npy file (<path>.npy) with spare
+    capacity; the row -> user_id mapping is kept in <path>.json. Enrolling a
+    user writes a single row in place (the file only grows, by doubling,
+    when it is full), and a probe or a batch of probes is scored against
+    every user with one matrix multiply.
+
+    Rows are stored as float32, float16 or int8 (per-row scales in
+    <path>.scales.npy). An existing gallery keeps the dtype it was built with.
+    """
+
+    def __init__(self, path=FACE_GALLERY_PATH, dtype=FACE_EMBEDDING_DTYPE):
+        if dtype not in EMBEDDING_DTYPES:
+            raise ValueError(f"Unknown embedding dtype: {dtype} (expected one of {EMBEDDING_DTYPES})")
+        self.path = path
+        self.dtype = dtype
+        self.matrix_path = f"{path}.npy"
+        self.scales_path = f"{path}.scales.npy"
+        self.ids_path = f"{path}.json"
+        self._lock = threading.Lock()
+        self._matrix = None
+        self._scales = None
+        self._user_ids = []
+        self._rows = {}
+        self._ids_mtime = None
+        self._refresh()
+
+    def __len__(self):
+        self._refresh()
+        return len(self._user_ids)
+
+    @property
+    def user_ids(self):
+        self._refresh()
+        return list(self._user_ids)
+
+    def _refresh(self):
+        """(Re)open the files if another process has changed them"""
+        try:
+            mtime = os.stat(self.ids_path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._ids_mtime:
+            return
+
+        with open(self.ids_path) as f:
+            meta = json.load(f)
+        self._user_ids = meta['user_ids']
+        self.dtype = meta.get('dtype', 'float32')
+        self._rows = {user_id: row for row, user_id in enumerate(self._user_ids)}
+        self._matrix = np.load(self.matrix_path, mmap_mode='r+')
+        self._scales = np.load(self.scales_path, mmap_mode='r+') if self.dtype == 'int8' else None
+        self._ids_mtime = mtime
+
+    def _write_ids(self):
+        tmp_path = f"{self.ids_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'dtype': self.dtype, 'user_ids': self._user_ids}, f)
+        os.replace(tmp_path, self.ids_path)
+        self._ids_mtime = os.stat(self.ids_path).st_mtime_ns
+
+    def _allocate(self, capacity, dim):
+        """Create (or grow into) memory-mapped row storage with the given capacity"""
+        directory = os.path.dirname(self.matrix_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        files = [(self.matrix_path, self._matrix, self.dtype, (capacity, dim))]
+        if self.dtype == 'int8':
+            files.append((self.scales_path, self._scales, np.float32, (capacity,)))
+
+        count = len(self._user_ids)
+        opened = []
+        for path, current, dtype, shape in files:
+            tmp_path = f"{path}.tmp"
+            grown = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=dtype, shape=shape)
+            if count:
+                grown[:count] = current[:count]
+            grown.flush()
+            del grown
+            os.replace(tmp_path, path)
+            opened.append(np.load(path, mmap_mode='r+'))
+
+        self._matrix = opened[0]
+        self._scales = opened[1] if self.dtype == 'int8' else None
+
+    def _write_rows(self, start, vectors):
+        """Quantize normalized vectors into rows start.. of the storage"""
+        codes, scales = quantize_embeddings(vectors, self.dtype)
+        self._matrix[start:start + len(codes)] = codes
+        self._matrix.flush()
+        if scales is not None:
+            self._scales[start:start + len(scales)] = scales
+            self._scales.flush()
+
+    @staticmethod
+    def _normalize(vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / (norms + 1e-7)
+
+    def add(self, user_id, embedding):
+        """Insert or overwrite one user's embedding in place; returns its row"""
+        vector = self._normalize(np.ravel(embedding))
+
+        with self._lock:
+            self._refresh()
+            if self._matrix is not None and self._matrix.shape[1] != vector.size:
+                raise ValueError(f"Embedding size {vector.size} does not match gallery size {self._matrix.shape[1]}")
+
+            row = self._rows.get(user_id)
+            if row is None:
+                row = len(self._user_ids)
+                if self._matrix is None or row >= self._matrix.shape[0]:
+                    capacity = 64 if self._matrix is None else 2 * self._matrix.shape[0]
+                    self._allocate(capacity, vector.size)
+
+            self._write_rows(row, vector[None, :])
+
+            if user_id not in self._rows:
+                self._rows[user_id] = row
+                self._user_ids.append(user_id)
+                self._write_ids()
+            return row
+
+    def rebuild(self, embeddings, dtype=None):
+        """Replace the whole gallery with a dict of user_id -> embedding"""
+        with self._lock:
+            self._user_ids, self._rows, self._matrix, self._scales = [], {}, None, None
+            if dtype is not None:
+                self.dtype = dtype
+            if not embeddings:
+                for path in (self.matrix_path, self.scales_path, self.ids_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+                self._ids_mtime = None
+                return
+
+            vectors = self._normalize(np.stack([np.ravel(e) for e in embeddings.values()]))
+            self._allocate(max(64, len(vectors)), vectors.shape[1])
+            self._write_rows(0, vectors)
+
+            self._user_ids = list(embeddings.keys())
+            self._rows = {user_id: row for row, user_id in enumerate(self._user_ids)}
+            self._write_ids()
+
+    def scores(self, probes):
+        """Cosine similarity of each probe against every enrolled user, shape (B, N)"""
+        self._refresh()
+        probes = self._normalize(np.atleast_2d(probes))
+        count = len(self._user_ids)
+        if count == 0:
+            return np.zeros((len(probes), 0), np.float32)
+        if self.dtype == 'float32':
+            return probes @ self._matrix[:count].T
+
+        # Quantized rows: widen one block at a time, then a float32 matmul
+        scores = np.empty((len(probes), count), np.float32)
+        for start in range(0, count, _SCAN_BLOCK):
+            stop = min(start + _SCAN_BLOCK, count)
+            block = self._matrix[start:stop].astype(np.float32)
+            scores[:, start:stop] = probes @ block.T
+            if self._scales is not None:
+                scores[:, start:stop] *= self._scales[start:stop]
+        return scores
+
+    def vectors(self, rows=None):
+        """Dequantized float32 rows (all enrolled rows by default)"""
+        self._refresh()
+        if rows is None:
+            rows = np.arange(len(self._user_ids))
+        scales = self._scales[rows] if self._scales is not None else None
+        return dequantize_embeddings(self._matrix[rows], scales)
+
+    def score_rows(self, probe, rows):
+        """Cosine similarity of one probe against selected rows only"""
+        probe = self._normalize(np.ravel(probe))
+        return self.vectors(rows) @ probe
+
+    def top_k(self, scores, top_k=5, rows=None):
+        """(user_id, score) list for the best scores; rows maps score columns to gallery rows"""
+        k = min(top_k, len(scores))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        row_ids = top if rows is None else rows[top]
+        return [(self._user_ids[r], float(scores[t])) for r, t in zip(row_ids, top)]
+
+    def identify(self, probes, top_k=5):
+        """
+        Top-k enrolled users for a probe embedding or a (B, D) batch
+
+        Returns:
+            list of (user_id, score) tuples, best first; for a batch, one
+            such list per probe
+        """
+        single = np.ndim(probes) == 1
+        results = [self.top_k(row, top_k) for row in self.scores(probes)]
+        return results[0] if single else results
+
+_default_gallery = None
+_default_gallery_lock = threading.Lock()
+_default_ann_index = None
+
+def get_face_gallery():
+    """
+    Process-wide FaceGallery at FACE_GALLERY_PATH
+
+    Built from the template store the first time it is needed (e.g. right
+    after migrating pickle templates); kept up to date by enrollment after that.
+    """
+    global _default_gallery
+    if _default_gallery is None:
+        with _default_gallery_lock:
+            if _default_gallery is None:
+                gallery = FaceGallery(FACE_GALLERY_PATH)
+                if len(gallery) == 0 or gallery.dtype != FACE_EMBEDDING_DTYPE:
+                    rebuild_face_gallery(gallery)
+                _default_gallery = gallery
+    return _default_gallery
+
+def rebuild_face_gallery(gallery=None):
+    """Rebuild the gallery from every face template in the template store"""
+    from modules.face_recognition import deserialize_face_embedding
+    from modules.template_store import get_store, FACE
+
+    if gallery is None:
+        gallery = get_face_gallery()
+    blobs = get_store().load_all(FACE)
+    gallery.rebuild({user_id: deserialize_face_embedding(data) for user_id, data in blobs.items()},
+                    dtype=FACE_EMBEDDING_DTYPE)
+
+    # Rows were renumbered: the ANN index is retrained on next use
+    if gallery.path == FACE_GALLERY_PATH:
+        (_default_ann_index or FaceANNIndex(FACE_ANN_PATH)).reset()
+    return gallery
+
+class FaceANNIndex:
+    """
+    Inverted-file (IVF) approximate nearest-neighbour index over FaceGallery rows
+
+    Spherical k-means splits the gallery into nlist cells. A probe is only
+    compared against the rows of its nprobe closest cells, so nprobe is the
+    recall/latency knob (nprobe = nlist is an exact search). The centroids
+    and the row -> cell assignment are persisted next to the template
+    database (path=None keeps the index in memory), and enrolled rows are
+    assigned to a cell incrementally.
+    """
+
+    def __init__(self, path=FACE_ANN_PATH):
+        self.path = path
+        self.centroids = None
+        self.assignment = np.empty(0, np.int32)
+        self.trained_size = 0
+        self._lists = None
+        self._mtime = None
+        self._lock = threading.Lock()
+        self._refresh()
+
+    @property
+    def trained(self):
+        self._refresh()
+        return self.centroids is not None
+
+    def _refresh(self):
+        if self.path is None:
+            return
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            if self._mtime is not None:
+                # Removed by a rebuild in another process
+                self.centroids, self.assignment, self.trained_size = None, np.empty(0, np.int32), 0
+                self._lists, self._mtime = None, None
+            return
+        if mtime == self._mtime:
+            return
+        with np.load(self.path) as data:
+            self.centroids = data['centroids']
+            self.assignment = data['assignment']
+            self.trained_size = int(data['trained_size'])
+        self._lists = None
+        self._mtime = mtime
+
+    def save(self):
+        if self.path is None:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp.npz"
+        np.savez(tmp_path, centroids=self.centroids, assignment=self.assignment,
+                 trained_size=np.int64(self.trained_size))
+        os.replace(tmp_path, self.path)
+        self._mtime = os.stat(self.path).st_mtime_ns
+
+    def reset(self):
+        """Forget the trained index (and its file)"""
+        with self._lock:
+            self.centroids, self.assignment, self.trained_size = None, np.empty(0, np.int32), 0
+            self._lists, self._mtime = None, None
+            if self.path is not None and os.path.exists(self.path):
+                os.remove(self.path)
+
+    def _assign(self, vectors, block=16384):
+        """Closest centroid for each row, in blocks"""
+        cells = np.empty(len(vectors), np.int32)
+        for start in range(0, len(vectors), block):
+            cells[start:start + block] = np.argmax(vectors[start:start + block] @ self.centroids.T, axis=1)
+        return cells
+
+    def train(self, vectors, nlist=None, iterations=10, sample_per_list=256, seed=0):
+        """Run spherical k-means on (a sample of) vectors and assign every row"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        nlist = nlist or max(1, int(np.sqrt(len(vectors))))
+        nlist = min(nlist, len(vectors))
+        rng = np.random.default_rng(seed)
+
+        sample = vectors
+        if len(vectors) > nlist * sample_per_list:
+            sample = vectors[rng.choice(len(vectors), nlist * sample_per_list, replace=False)]
+
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            similarity = sample @ centroids.T
+            cells = np.argmax(similarity, axis=1)
+
+            # Cell sums via sort + reduceat (much faster than np.add.at)
+            order = np.argsort(cells, kind='stable')
+            present, starts = np.unique(cells[order], return_index=True)
+            sums = np.add.reduceat(sample[order], starts, axis=0)
+            centroids[present] = sums / (np.linalg.norm(sums, axis=1, keepdims=True) + 1e-7)
+
+            # Re-seed empty cells with the worst-served points
+            empty = np.setdiff1d(np.arange(nlist), present)
+            if len(empty):
+                worst = np.argsort(similarity[np.arange(len(sample)), cells])[:len(empty)]
+                centroids[empty] = sample[worst]
+
+        with self._lock:
+            self.centroids = centroids
+            self.assignment = self._assign(vectors)
+            self.trained_size = len(vectors)
+            self._lists = None
+            self.save()
+
+    def add(self, row, vector):
+        """Assign one (new or re-enrolled) gallery row to its closest cell"""
+        with self._lock:
+            self._refresh()
+            if self.centroids is None:
+                return
+            vector = np.asarray(vector, dtype=np.float32).ravel()
+            cell = np.int32(np.argmax(self.centroids @ vector))
+            if row >= len(self.assignment):
+                grown = np.full(row + 1, -1, np.int32)
+                grown[:len(self.assignment)] = self.assignment
+                self.assignment = grown
+            self.assignment[row] = cell
+            self._lists = None
+            self.save()
+
+    def candidates(self, probe, nprobe=FACE_ANN_NPROBE):
+        """Gallery rows in the nprobe cells closest to the probe"""
+        self._refresh()
+        if self._lists is None:
+            order = np.argsort(self.assignment, kind='stable')
+            bounds = np.searchsorted(self.assignment[order], np.arange(len(self.centroids) + 1))
+            self._lists = (order, bounds)
+        order, bounds = self._lists
+
+        nprobe = min(nprobe, len(self.centroids))
+        cells = np.argpartition(-(self.centroids @ np.ravel(probe)), nprobe - 1)[:nprobe]
+        return np.concatenate([order[bounds[c]:bounds[c + 1]] for c in cells])
+
+def get_face_ann_index(gallery=None):
+    """
+    Process-wide FaceANNIndex, trained or caught up with the gallery as needed
+
+    The index is (re)trained when it does not exist yet or the gallery has
+    grown to more than 4x the size it was trained on; rows added by other
+    processes since the last save are assigned incrementally.
+    """
+    global _default_ann_index
+    gallery = gallery if gallery is not None else get_face_gallery()
+    with _default_gallery_lock:
+        if _default_ann_index is None:
+            _default_ann_index = FaceANNIndex(FACE_ANN_PATH)
+    index = _default_ann_index
+
+    count = len(gallery)
+    if not index.trained or count > 4 * index.trained_size:
+        index.train(gallery.vectors())
+    elif len(index.assignment) < count:
+        missing = np.arange(len(index.assignment), count)
+        for row, vector in zip(missing, gallery.vectors(missing)):
+            index.add(row, vector)
+    return index
+
+def enroll_face_embedding(user_id, embedding):
+    """Add an enrolled embedding to the gallery and, if trained, the ANN index"""
+    gallery = get_face_gallery()
+    row = gallery.add(user_id, embedding)
+    if _default_ann_index is not None or os.path.exists(FACE_ANN_PATH):
+        index = _default_ann_index or FaceANNIndex(FACE_ANN_PATH)
+        index.add(row, gallery.vectors(np.array([row]))[0])
+    return row
+
+def identify_embeddings(probes, top_k=5, nprobe=FACE_ANN_NPROBE):
+    """
+    Top-k users for a probe embedding or a (B, D) batch
+
+    Small galleries (< FACE_ANN_MIN_USERS) use the exact matrix scan; larger
+    ones only score the candidates returned by the IVF index.
+    """
+    gallery = get_face_gallery()
+    if len(gallery) < FACE_ANN_MIN_USERS:
+        return gallery.identify(probes, top_k)
+
+    index = get_face_ann_index(gallery)
+    single = np.ndim(probes) == 1
+    results = []
+    for probe in np.atleast_2d(probes):
+        rows = index.candidates(probe, nprobe)
+        results.append(gallery.top_k(gallery.score_rows(probe, rows), top_k, rows))
+    return results[0] if single else results
+
+def quantization_report(embeddings, probes=None, top_k=5, repeats=5, noise=0.05, seed=0):
+    """
+    Accuracy vs. speed of each storage dtype against a float64 baseline
+
+    Args:
+        embeddings: (N, D) gallery embeddings (e.g. from extract_face_embedding)
+        probes: (B, D) probe embeddings; defaults to noisy copies of up to
+                100 gallery embeddings
+        top_k: depth used for the top-k agreement metric
+        repeats: scans timed per dtype (best is reported)
+
+    Returns:
+        dict mapping dtype to bytes per vector, gallery size in bytes, best
+        scan time in ms, score error statistics and top-1 / top-k agreement
+        with the float64 ranking
+    """
+    gallery = np.asarray(embeddings, dtype=np.float64)
+    gallery = gallery / (np.linalg.norm(gallery, axis=1, keepdims=True) + 1e-12)
+    if probes is None:
+        rng = np.random.default_rng(seed)
+        picked = gallery[:min(100, len(gallery))]
+        probes = picked + noise * rng.standard_normal(picked.shape) / np.sqrt(gallery.shape[1])
+    probes = np.asarray(probes, dtype=np.float64)
+    probes = probes / (np.linalg.norm(probes, axis=1, keepdims=True) + 1e-12)
+    k = min(top_k, len(gallery))
+
+    def ranking(scores):
+        return np.argsort(-scores, axis=1, kind='stable')[:, :k]
+
+    start = time.perf_counter()
+    baseline = probes @ gallery.T
+    baseline_ms = (time.perf_counter() - start) * 1000
+    baseline_rank = ranking(baseline)
+
+    report = {'float64': {
+        'bytes_per_vector': gallery.shape[1] * 8,
+        'gallery_bytes': gallery.nbytes,
+        'scan_ms': round(baseline_ms, 3),
+        'max_abs_error': 0.0, 'mean_abs_error': 0.0,
+        'top1_agreement': 1.0, 'topk_agreement': 1.0
+    }}
+
+    probes32 = probes.astype(np.float32)
+    for dtype in EMBEDDING_DTYPES:
+        codes, scales = quantize_embeddings(gallery, dtype)
+        best = float('inf')
+        for _ in range(repeats):
+            start = time.perf_counter()
+            if dtype == 'float32':
+                scores = probes32 @ codes.T
+            else:
+                scores = probes32 @ codes.astype(np.float32).T
+                if scales is not None:
+                    scores *= scales
+            best = min(best, time.perf_counter() - start)
+
+        error = np.abs(scores - baseline)
+        rank = ranking(scores)
+        overlap = [len(np.intersect1d(a, b)) / k for a, b in zip(rank, baseline_rank)]
+        report[dtype] = {
+            'bytes_per_vector': codes[0].nbytes + (4 if scales is not None else 0),
+            'gallery_bytes': codes.nbytes + (scales.nbytes if scales is not None else 0),
+            'scan_ms': round(best * 1000, 3),
+            'max_abs_error': float(error.max()),
+            'mean_abs_error': float(error.mean()),
+            'top1_agreement': float(np.mean(rank[:, 0] == baseline_rank[:, 0])),
+            'topk_agreement': float(np.mean(overlap))
+        }
+
+    return report
+
+def ann_recall_report(embeddings, probes=None, nprobes=(1, 2, 4, 8, 16, 32), nlist=None,
+                      top_k=5, noise=0.05, seed=0):
+    """
+    Recall vs. latency of the IVF index for a range of nprobe values
+
+    Args:
+        embeddings: (N, D) gallery embeddings (e.g. from extract_face_embedding)
+        probes: (B, D) probe embeddings; defaults to noisy copies of up to
+                100 gallery embeddings
+        nprobes: nprobe values to evaluate
+        nlist: number of IVF cells (default sqrt(N))
+
+    Returns:
+        dict with the exact scan time per probe ('exact_ms') and, per nprobe,
+        the top-k recall against the exact ranking, the mean fraction of the
+        gallery scanned and the mean search time per probe in ms
+    """
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    vectors = vectors / (np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-7)
+    if probes is None:
+        rng = np.random.default_rng(seed)
+        picked = vectors[:min(100, len(vectors))]
+        probes = picked + noise * rng.standard_normal(picked.shape) / np.sqrt(vectors.shape[1])
+    probes = np.asarray(probes, dtype=np.float32)
+    probes = probes / (np.linalg.norm(probes, axis=1, keepdims=True) + 1e-7)
+    k = min(top_k, len(vectors))
+
+    start = time.perf_counter()
+    exact = np.argsort(-(probes @ vectors.T), axis=1, kind='stable')[:, :k]
+    report = {'exact_ms': round((time.perf_counter() - start) * 1000 / len(probes), 3)}
+
+    index = FaceANNIndex(path=None)
+    index.train(vectors, nlist=nlist, seed=seed)
+
+    for nprobe in nprobes:
+        recall, scanned = [], []
+        start = time.perf_counter()
+        for probe, truth in zip(probes, exact):
+            rows = index.candidates(probe, nprobe)
+            scores = vectors[rows] @ probe
+            top = rows[np.argsort(-scores, kind='stable')[:k]]
+            recall.append(len(np.intersect1d(top, truth)) / k)
+            scanned.append(len(rows) / len(vectors))
+        report[nprobe] = {
+            'recall': float(np.mean(recall)),
+            'scanned_fraction': float(np.mean(scanned)),
+            'search_ms': round((time.perf_counter() - start) * 1000 / len(probes), 3)
+        }
+    return report
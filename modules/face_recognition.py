@@ -3,25 +3,69 @@ import numpy as np
 from sklearn.metrics.pairwise import cosine_similarity
 import pickle
 import os
+import struct
+from modules.template_store import get_store, FACE
+from modules.template_cache import template_cache
+from modules.face_features import face_feature_extractor
+from modules.image_context import ImageContext
+from modules.face_index import (identify_embeddings, enroll_face_embedding,
+                                quantize_embeddings, dequantize_embeddings)
+from modules.settings import (FACE_EMBEDDING_DTYPE, FACE_DETECTION_SCALE,
+                              FACE_DETECTION_MIN_FRACTION, FACE_DETECTION_MAX_FRACTION)
 
 # Initialize OpenCV face detector (no download needed!)
 face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
 
-def extract_face_embedding(image):
-    """Extract face features using OpenCV + histogram"""
-    # Convert to grayscale
-    if len(image.shape) == 3:
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    else:
-        gray = image.copy()
-    
-    # Detect faces
+# Smallest window the Haar cascade was trained on
+_CASCADE_WINDOW = 24
+
+def detect_faces(gray, max_side=FACE_DETECTION_SCALE):
+    """
+    Detect faces on a copy of the frame downscaled to at most max_side pixels
+    
+    The detection pyramid is bounded by FACE_DETECTION_MIN_FRACTION and
+    FACE_DETECTION_MAX_FRACTION of the frame's shorter side, so the number of
+    scales searched does not depend on the camera resolution.
+    
+    Returns:
+        int array of (x, y, w, h) boxes in full-resolution coordinates
+    """
+    h, w = gray.shape[:2]
+    scale = min(1.0, max_side / max(h, w))
+    small = cv2.resize(gray, (round(w * scale), round(h * scale)), interpolation=cv2.INTER_AREA) \
+        if scale < 1.0 else gray
+    
+    short_side = min(small.shape[:2])
+    min_face = max(_CASCADE_WINDOW, int(short_side * FACE_DETECTION_MIN_FRACTION))
+    max_face = max(min_face, int(short_side * FACE_DETECTION_MAX_FRACTION))
+    
     faces = face_cascade.detectMultiScale(
-        gray,
+        small,
         scaleFactor=1.1,
         minNeighbors=5,
-        minSize=(30, 30)
+        minSize=(min_face, min_face),
+        maxSize=(max_face, max_face)
     )
+    if len(faces) == 0:
+        return np.empty((0, 4), dtype=np.int32)
+    
+    # Map boxes back to the full-resolution frame
+    boxes = np.rint(np.asarray(faces, dtype=np.float64) / scale).astype(np.int32)
+    boxes[:, 2] = np.minimum(boxes[:, 2], w - boxes[:, 0])
+    boxes[:, 3] = np.minimum(boxes[:, 3], h - boxes[:, 1])
+    return boxes
+
+def extract_face_embedding(image):
+    """
+    Extract face features using OpenCV + histogram
+    
+    image may be an ImageContext, whose grayscale image and face box are
+    then reused instead of recomputed.
+    """
+    context = ImageContext.of(image)
+    
+    # Detect faces (on a downscaled copy; boxes are full resolution)
+    faces = context.faces
     
     print(f"Detected {len(faces)} face(s)")
     
@@ -33,64 +77,97 @@ def extract_face_embedding(image):
         return None
     
     # Get the largest face
-    largest_face = max(faces, key=lambda rect: rect[2] * rect[3])
-    x, y, w, h = largest_face
-    
-    # Extract face region
-    face_roi = gray[y:y+h, x:x+w]
-    
-    # Resize to standard size
-    face_resized = cv2.resize(face_roi, (100, 100))
-    
-    # Normalize
-    face_normalized = cv2.equalizeHist(face_resized)
-    
-    # Create feature vector using multiple methods
-    features = []
-    
-    # 1. HOG features (Histogram of Oriented Gradients)
-    hog = cv2.HOGDescriptor((100, 100), (20, 20), (10, 10), (10, 10), 9)
-    hog_features = hog.compute(face_normalized)
-    features.extend(hog_features.flatten())
+    x, y, w, h = context.face_box
     
-    # 2. LBP-like features (Local Binary Patterns approximation)
-    # Divide face into regions and compute histograms
-    regions = 8
-    region_h = face_normalized.shape[0] // regions
-    region_w = face_normalized.shape[1] // regions
+    # Extract face region at full resolution
+    face_roi = context.gray[y:y+h, x:x+w]
     
-    for i in range(regions):
-        for j in range(regions):
-            region = face_normalized[i*region_h:(i+1)*region_h, j*region_w:(j+1)*region_w]
-            hist = cv2.calcHist([region], [0], None, [16], [0, 256])
-            features.extend(hist.flatten())
+    # HOG + regional histogram features (descriptor reused across calls)
+    return face_feature_extractor.extract(face_roi)
+
+def extract_face_embeddings(faces):
+    """
+    Features for a batch of already-cropped faces (bulk enrollment and
+    identification); returns an (N, D) float32 matrix
+    """
+    return face_feature_extractor.extract_batch(faces)
+
+# Binary embedding format: magic | version | dtype code | length | [int8 scale] | values
+_EMBEDDING_MAGIC = b"FCEM"
+_EMBEDDING_VERSION = 2
+_EMBEDDING_HEADER = struct.Struct("<4sHBI")
+_EMBEDDING_SCALE = struct.Struct("<f")
+_EMBEDDING_DTYPES = {0: np.dtype('<f4'), 1: np.dtype('<f8'), 2: np.dtype('<f2'), 3: np.dtype('i1')}
+_EMBEDDING_CODES = {'float32': 0, 'float64': 1, 'float16': 2, 'int8': 3}
+
+def serialize_face_embedding(embedding, dtype=None):
+    """
+    Pack a face embedding into the versioned binary format
     
-    # Convert to numpy array and normalize
-    features = np.array(features)
-    features = features / (np.linalg.norm(features) + 1e-7)
+    dtype is one of "float32", "float16" or "int8" (per-vector scale);
+    default FACE_EMBEDDING_DTYPE.
+    """
+    dtype = dtype or FACE_EMBEDDING_DTYPE
+    codes, scales = quantize_embeddings(np.ravel(embedding), dtype)
+    header = _EMBEDDING_HEADER.pack(_EMBEDDING_MAGIC, _EMBEDDING_VERSION, _EMBEDDING_CODES[dtype], codes.size)
+    if scales is not None:
+        header += _EMBEDDING_SCALE.pack(float(scales))
+    return header + codes.astype(_EMBEDDING_DTYPES[_EMBEDDING_CODES[dtype]]).tobytes()
+
+def deserialize_face_embedding(data):
+    """
+    Unpack a binary face embedding
     
-    return features
+    float32/float64/float16 embeddings are read-only views over data;
+    int8 embeddings are dequantized to float32.
+    """
+    magic, version, code, length = _EMBEDDING_HEADER.unpack_from(data)
+    if magic != _EMBEDDING_MAGIC or version > _EMBEDDING_VERSION:
+        raise ValueError("Unsupported face embedding format")
+    
+    offset = _EMBEDDING_HEADER.size
+    if _EMBEDDING_DTYPES[code] == np.int8:
+        (scale,) = _EMBEDDING_SCALE.unpack_from(data, offset)
+        codes = np.frombuffer(data, dtype=np.int8, count=length, offset=offset + _EMBEDDING_SCALE.size)
+        return dequantize_embeddings(codes, np.float32(scale))
+    return np.frombuffer(data, dtype=_EMBEDDING_DTYPES[code], count=length, offset=offset)
+
+def read_legacy_embedding(filepath):
+    """Read a pickled face embedding file"""
+    with open(filepath, 'rb') as f:
+        return np.asarray(pickle.load(f))
 
 def save_face_embedding(embedding, user_id="default_user"):
-    """Save face features to database"""
-    os.makedirs("database", exist_ok=True)
-    filepath = f"database/face_{user_id}.pkl"
-    with open(filepath, 'wb') as f:
-        pickle.dump(embedding, f)
+    """Save face features to the template store"""
+    get_store().put(user_id, FACE, serialize_face_embedding(embedding))
+    template_cache.invalidate((FACE, user_id))
+    enroll_face_embedding(user_id, embedding)
     print(f"✅ Face features saved for user: {user_id}")
 
 def load_face_embedding(user_id="default_user"):
-    """Load face features from database"""
+    """Load face features (served from the in-process template cache when unchanged)"""
+    store = get_store()
+    return template_cache.get((FACE, user_id), lambda: _read_face_embedding(store, user_id),
+                              stamp=store.version(user_id, FACE))
+
+def _read_face_embedding(store, user_id):
+    """Read face features from the template store (falls back to legacy pickle files)"""
+    data = store.get(user_id, FACE)
+    if data is not None:
+        return deserialize_face_embedding(data)
+    
     filepath = f"database/face_{user_id}.pkl"
     if not os.path.exists(filepath):
         return None
-    with open(filepath, 'rb') as f:
-        return pickle.load(f)
+    return read_legacy_embedding(filepath)
 
 def verify_face(image, threshold=0.85, user_id="default_user"):
     """
     Verify face against stored features
     Returns tuple: (passed: bool, similarity_score: float)
+    
+    image may be an UploadedFile, bytes, a BGR array or an ImageContext
+    shared with check_liveness.
     """
     # Load stored features
     stored_features = load_face_embedding(user_id)
@@ -98,21 +175,8 @@ def verify_face(image, threshold=0.85, user_id="default_user"):
         print("⚠️ No face template found. Please enroll first.")
         return False, 0.0
     
-    # Convert Streamlit UploadedFile to numpy array
-    if hasattr(image, 'read'):
-        from PIL import Image as PILImage
-        pil_image = PILImage.open(image)
-        image = np.array(pil_image)
-        if len(image.shape) == 3 and image.shape[2] == 3:
-            image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-    
-    # Convert image if needed (from bytes)
-    if isinstance(image, bytes):
-        nparr = np.frombuffer(image, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    
-    # Extract features from input image
-    current_features = extract_face_embedding(image)
+    # Extract features from input image (decoded once)
+    current_features = extract_face_embedding(ImageContext.of(image))
     if current_features is None:
         print("❌ No face detected in image")
         return False, 0.0
@@ -127,4 +191,18 @@ def verify_face(image, threshold=0.85, user_id="default_user"):
     
     print(f"Face similarity: {similarity:.3f} (threshold: {threshold}) - {'PASS' if passed else 'FAIL'}")
     
-    return passed, float(similarity)
\ No newline at end of file
+    return passed, float(similarity)
+
+def identify_face(image, top_k=5):
+    """
+    1:N identification against every enrolled face
+    Returns list of (user_id, similarity) tuples, best first ([] if no face)
+    """
+    features = extract_face_embedding(image)
+    if features is None:
+        return []
+    return identify_embeddings(features, top_k=top_k)
+
+def identify_face_embeddings(embeddings, top_k=5):
+    """Batch 1:N identification for an (N, D) matrix of face embeddings"""
+    return identify_embeddings(np.atleast_2d(embeddings), top_k=top_k)
\ No newline at end of file
@@ -0,0 +1,120 @@
+import time
+import threading
+import numpy as np
+from modules.minutiae_matching import as_minutiae_array
+from modules.settings import (FINGERPRINT_CASCADE_COUNT_RATIO, FINGERPRINT_CASCADE_TYPE_DIFFERENCE,
+                              FINGERPRINT_CASCADE_ORIENTATION_DISTANCE)
+
+# Global descriptor stored next to each fingerprint template
+ORIENTATION_BINS = 12
+DESCRIPTOR_DTYPE = np.dtype([
+    ('count', '<u4'),
+    ('ending_ratio', '<f4'),
+    ('orientation', '<f4', (ORIENTATION_BINS,))
+])
+
+# Cascade stages, cheapest first; 'match' is the full minutiae matcher
+CASCADE_STAGES = ('count', 'type_ratio', 'orientation', 'match')
+
+def global_descriptor(minutiae):
+    """
+    Cheap whole-finger summary of a minutiae set
+
+    Returns:
+        0-d DESCRIPTOR_DTYPE array: minutiae count, fraction of ridge endings
+        and a normalized histogram of minutia angles
+    """
+    minutiae = as_minutiae_array(minutiae)
+    descriptor = np.zeros((), dtype=DESCRIPTOR_DTYPE)
+    descriptor['count'] = len(minutiae)
+    if len(minutiae) == 0:
+        return descriptor
+
+    descriptor['ending_ratio'] = np.count_nonzero(minutiae['type'] == 1) / len(minutiae)
+    bins = ((minutiae['angle'] % (2 * np.pi)) / (2 * np.pi) * ORIENTATION_BINS).astype(np.int64)
+    histogram = np.bincount(np.minimum(bins, ORIENTATION_BINS - 1), minlength=ORIENTATION_BINS)
+    descriptor['orientation'] = histogram / len(minutiae)
+    return descriptor
+
+def orientation_distance(a, b):
+    """
+    Total-variation distance between two angle histograms, minimized over
+    circular shifts so a rotated finger is not penalized (0 = identical, 1 = disjoint)
+    """
+    a, b = np.asarray(a), np.asarray(b)
+    shifted = np.stack([np.roll(b, shift) for shift in range(len(b))])
+    return float(0.5 * np.abs(shifted - a).sum(axis=1).min())
+
+class FingerprintCascade:
+    """
+    Coarse-to-fine fingerprint comparison
+
+    Global descriptors are compared stage by stage (minutiae count,
+    ending/bifurcation ratio, orientation histogram) and the comparison is
+    rejected at the first stage where they disagree strongly; only
+    survivors reach the full matcher. Thresholds are deliberately loose so
+    a genuine finger is never rejected by a prefilter. Per-stage counters
+    and timings are kept for tuning.
+    """
+
+    def __init__(self, count_ratio=FINGERPRINT_CASCADE_COUNT_RATIO,
+                 type_difference=FINGERPRINT_CASCADE_TYPE_DIFFERENCE,
+                 orientation_distance=FINGERPRINT_CASCADE_ORIENTATION_DISTANCE):
+        self.count_ratio = count_ratio
+        self.type_difference = type_difference
+        self.orientation_distance = orientation_distance
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Clear the per-stage counters"""
+        with self._lock:
+            self._evaluated = dict.fromkeys(CASCADE_STAGES, 0)
+            self._rejected = dict.fromkeys(CASCADE_STAGES, 0)
+            self._seconds = dict.fromkeys(CASCADE_STAGES, 0.0)
+
+    def record(self, stage, seconds, rejected):
+        """Account one evaluation of a stage"""
+        with self._lock:
+            self._evaluated[stage] += 1
+            self._rejected[stage] += bool(rejected)
+            self._seconds[stage] += seconds
+
+    def prefilter(self, stored, probe):
+        """
+        Run the descriptor stages on two global descriptors
+
+        Returns:
+            name of the rejecting stage, or None if the pair survives
+        """
+        checks = (
+            ('count', lambda: min(stored['count'], probe['count'])
+                              < self.count_ratio * max(stored['count'], probe['count'])),
+            ('type_ratio', lambda: abs(float(stored['ending_ratio']) - float(probe['ending_ratio']))
+                                   > self.type_difference),
+            ('orientation', lambda: orientation_distance(stored['orientation'], probe['orientation'])
+                                    > self.orientation_distance),
+        )
+        for stage, reject in checks:
+            start = time.perf_counter()
+            rejected = bool(reject())
+            self.record(stage, time.perf_counter() - start, rejected)
+            if rejected:
+                return stage
+        return None
+
+    def stats(self):
+        """Per-stage evaluations, rejections, rejection rate and mean time in ms"""
+        with self._lock:
+            return {
+                stage: {
+                    'evaluated': self._evaluated[stage],
+                    'rejected': self._rejected[stage],
+                    'rejection_rate': self._rejected[stage] / self._evaluated[stage] if self._evaluated[stage] else 0.0,
+                    'mean_ms': self._seconds[stage] * 1000 / self._evaluated[stage] if self._evaluated[stage] else 0.0
+                }
+                for stage in CASCADE_STAGES
+            }
+
+# Shared by verify_fingerprint
+fingerprint_cascade = FingerprintCascade()
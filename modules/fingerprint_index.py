@@ -0,0 +1,274 @@
+import os
+import time
+import threading
+import numpy as np
+from modules.minutiae_matching import as_minutiae_array, align_and_match, spread_subset, expand_ranges
+from modules.settings import FINGERPRINT_INDEX_PATH, FINGERPRINT_INDEX_CANDIDATES
+
+# Pair feature quantization: distance in pixels, relative angles in radians
+_DISTANCE_BIN = 8
+_ANGLE_BIN = np.deg2rad(20)
+_N_ANGLE = int(round(2 * np.pi / _ANGLE_BIN))
+
+def pair_keys(minutiae, neighbours=6, max_distance=160, max_minutiae=512):
+    """
+    Rotation- and translation-invariant hash keys of neighbouring minutia pairs
+
+    Every minutia is paired with its nearest neighbours (up to max_distance
+    pixels away). An ordered pair (i, j) is described by its length and by
+    the angles of both minutiae relative to the i -> j direction, plus both
+    minutia types; the quantized values are packed into one int64 key.
+
+    Returns:
+        int64 array of keys (one per pair, unsorted, may repeat)
+    """
+    minutiae = spread_subset(as_minutiae_array(minutiae), max_minutiae)
+    if len(minutiae) < 2:
+        return np.empty(0, np.int64)
+
+    xy = np.column_stack((minutiae['x'], minutiae['y'])).astype(np.float32)
+    distance = np.linalg.norm(xy[:, None, :] - xy[None, :, :], axis=2)
+    np.fill_diagonal(distance, np.inf)
+
+    k = min(neighbours, len(minutiae) - 1)
+    j = np.argpartition(distance, k - 1, axis=1)[:, :k].ravel()
+    i = np.repeat(np.arange(len(minutiae)), k)
+    d = distance[i, j]
+    keep = d <= max_distance
+    i, j, d = i[keep], j[keep], d[keep]
+
+    direction = np.arctan2(xy[j, 1] - xy[i, 1], xy[j, 0] - xy[i, 0])
+    angle = minutiae['angle'].astype(np.float32)
+    a_i = ((angle[i] - direction) % (2 * np.pi) / _ANGLE_BIN).astype(np.int64) % _N_ANGLE
+    a_j = ((angle[j] - direction) % (2 * np.pi) / _ANGLE_BIN).astype(np.int64) % _N_ANGLE
+    d_bin = (d / _DISTANCE_BIN).astype(np.int64)
+    t_i = (minutiae['type'][i] == 3).astype(np.int64)
+    t_j = (minutiae['type'][j] == 3).astype(np.int64)
+
+    return (((d_bin * _N_ANGLE + a_i) * _N_ANGLE + a_j) * 2 + t_i) * 2 + t_j
+
+def _template_keys(template):
+    """Pair keys of minutiae, reusing those saved in a PreparedTemplate"""
+    keys = getattr(template, 'pair_keys', None)
+    return keys if keys is not None else pair_keys(template)
+
+class FingerprintIndex:
+    """
+    Geometric-hashing index for 1:N fingerprint identification
+
+    The pair keys of every enrolled template are kept in one sorted array
+    with a parallel array of owner rows, so a probe's keys are looked up with
+    searchsorted and each hit votes for its owner. Votes are normalized by
+    the size of the owner's template and the best users form a short
+    candidate list for the full matcher. The arrays are persisted next to
+    the template database (path=None keeps the index in memory).
+    """
+
+    def __init__(self, path=FINGERPRINT_INDEX_PATH):
+        self.path = path
+        self._keys = np.empty(0, np.int64)
+        self._owners = np.empty(0, np.int32)
+        self._sizes = np.empty(0, np.int64)
+        self._user_ids = []
+        self._rows = {}
+        self._mtime = None
+        self._lock = threading.Lock()
+        self._refresh()
+
+    def __len__(self):
+        self._refresh()
+        return len(self._user_ids)
+
+    @property
+    def user_ids(self):
+        self._refresh()
+        return list(self._user_ids)
+
+    def _refresh(self):
+        """Reload the index if another process has saved it"""
+        if self.path is None:
+            return
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._mtime:
+            return
+
+        with np.load(self.path) as data:
+            self._keys = data['keys']
+            self._owners = data['owners']
+            self._sizes = data['sizes']
+            self._user_ids = data['user_ids'].tolist()
+        self._rows = {user_id: row for row, user_id in enumerate(self._user_ids)}
+        self._mtime = mtime
+
+    def save(self):
+        if self.path is None:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp.npz"
+        np.savez(tmp_path, keys=self._keys, owners=self._owners, sizes=self._sizes,
+                 user_ids=np.array(self._user_ids, dtype=str))
+        os.replace(tmp_path, self.path)
+        self._mtime = os.stat(self.path).st_mtime_ns
+
+    def build(self, templates):
+        """Replace the index with a dict of user_id -> minutiae (or PreparedTemplate)"""
+        user_ids = list(templates)
+        keys = [_template_keys(templates[user_id]) for user_id in user_ids]
+        owners = [np.full(len(k), row, np.int32) for row, k in enumerate(keys)]
+
+        all_keys = np.concatenate(keys) if keys else np.empty(0, np.int64)
+        all_owners = np.concatenate(owners) if owners else np.empty(0, np.int32)
+        order = np.argsort(all_keys, kind='stable')
+
+        with self._lock:
+            self._keys = all_keys[order]
+            self._owners = all_owners[order]
+            self._sizes = np.array([len(k) for k in keys], np.int64)
+            self._user_ids = user_ids
+            self._rows = {user_id: row for row, user_id in enumerate(user_ids)}
+            self.save()
+
+    def add(self, user_id, minutiae):
+        """Insert or replace one user's template (a linear-time merge)"""
+        keys = np.sort(_template_keys(minutiae))
+        with self._lock:
+            self._refresh()
+            row = self._rows.get(user_id)
+            if row is None:
+                row = len(self._user_ids)
+                self._user_ids.append(user_id)
+                self._rows[user_id] = row
+                self._sizes = np.append(self._sizes, 0)
+            else:
+                keep = self._owners != row
+                self._keys, self._owners = self._keys[keep], self._owners[keep]
+
+            positions = np.searchsorted(self._keys, keys)
+            self._keys = np.insert(self._keys, positions, keys)
+            self._owners = np.insert(self._owners, positions, np.int32(row))
+            self._sizes[row] = len(keys)
+            self.save()
+
+    def candidates(self, probe, limit=FINGERPRINT_INDEX_CANDIDATES):
+        """
+        Users most likely to own the probe minutiae
+
+        Returns:
+            list of up to limit (user_id, votes) tuples, most likely first;
+            users without a single matching pair are never returned
+        """
+        self._refresh()
+        keys = pair_keys(probe)
+        if len(keys) == 0 or len(self._keys) == 0:
+            return []
+
+        left = np.searchsorted(self._keys, keys, side='left')
+        right = np.searchsorted(self._keys, keys, side='right')
+        _, positions = expand_ranges(left, right)
+        if len(positions) == 0:
+            return []
+        votes = np.bincount(self._owners[positions], minlength=len(self._user_ids))
+
+        score = votes / np.sqrt(np.maximum(self._sizes, 1))
+        ranked = np.argsort(-score, kind='stable')[:limit]
+        return [(self._user_ids[row], int(votes[row])) for row in ranked if votes[row] > 0]
+
+_default_index = None
+_default_index_lock = threading.Lock()
+
+def get_fingerprint_index():
+    """
+    Process-wide FingerprintIndex at FINGERPRINT_INDEX_PATH
+
+    Built from the template store the first time it is needed; kept up to
+    date by enrollment after that.
+    """
+    global _default_index
+    if _default_index is None:
+        with _default_index_lock:
+            if _default_index is None:
+                index = FingerprintIndex(FINGERPRINT_INDEX_PATH)
+                if not os.path.exists(FINGERPRINT_INDEX_PATH):
+                    rebuild_fingerprint_index(index)
+                _default_index = index
+    return _default_index
+
+def rebuild_fingerprint_index(index=None):
+    """Rebuild the index from every fingerprint template in the template store"""
+    from modules.fingerprint_template import deserialize_prepared_template
+    from modules.template_store import get_store, FINGERPRINT
+
+    if index is None:
+        index = get_fingerprint_index()
+    blobs = get_store().load_all(FINGERPRINT)
+    index.build({user_id: deserialize_prepared_template(data) for user_id, data in blobs.items()})
+    return index
+
+def index_fingerprint_template(user_id, minutiae):
+    """Add an enrolled template to the index (if one has been built)"""
+    if _default_index is not None:
+        _default_index.add(user_id, minutiae)
+    elif os.path.exists(FINGERPRINT_INDEX_PATH):
+        FingerprintIndex(FINGERPRINT_INDEX_PATH).add(user_id, minutiae)
+
+def identification_latency_curve(templates, probes, sizes=(10, 100, 1000), candidates=FINGERPRINT_INDEX_CANDIDATES,
+                                 max_hypotheses=3):
+    """
+    Identification latency and accuracy of the index against gallery size
+
+    Args:
+        templates: dict of user_id -> enrolled minutiae
+        probes: dict of user_id -> probe minutiae of the same finger
+                (users missing from a gallery are skipped)
+        sizes: gallery sizes to evaluate (first N templates)
+        candidates: candidate list length passed to the full matcher
+
+    Returns:
+        list of dicts (one per size) with the build time, mean index lookup
+        and candidate matching time per probe in ms, the estimated
+        brute-force time (mean single-match cost x gallery size), the
+        fraction of probes whose owner made the candidate list and the
+        fraction identified correctly at rank 1
+    """
+    user_ids = list(templates)
+    curve = []
+    for size in sizes:
+        gallery = {user_id: templates[user_id] for user_id in user_ids[:size]}
+        index = FingerprintIndex(path=None)
+        start = time.perf_counter()
+        index.build(gallery)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        lookup, matching, single, hits, correct = [], [], [], 0, 0
+        queries = [user_id for user_id in probes if user_id in gallery]
+        for user_id in queries:
+            start = time.perf_counter()
+            shortlist = index.candidates(probes[user_id], candidates)
+            lookup.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            scores = [(align_and_match(gallery[owner], probes[user_id], max_hypotheses=max_hypotheses)['score'], owner)
+                      for owner, _ in shortlist]
+            matching.append(time.perf_counter() - start)
+            if shortlist:
+                single.append(matching[-1] / len(shortlist))
+
+            hits += any(owner == user_id for owner, _ in shortlist)
+            correct += bool(scores) and max(scores)[1] == user_id
+
+        n = max(len(queries), 1)
+        curve.append({
+            'gallery_size': len(gallery),
+            'build_ms': round(build_ms, 3),
+            'lookup_ms': round(float(np.mean(lookup)) * 1000, 3) if lookup else 0.0,
+            'matching_ms': round(float(np.mean(matching)) * 1000, 3) if matching else 0.0,
+            'brute_force_ms_est': round(float(np.mean(single)) * 1000 * len(gallery), 3) if single else 0.0,
+            'candidate_hit_rate': hits / n,
+            'rank1_accuracy': correct / n
+        })
+    return curve
@@ -1,16 +1,48 @@
 import cv2
 import numpy as np
-import pickle
 import os
+import time
+from functools import lru_cache
+from modules.thinning import skeletonize
+from modules.fingerprint_segmentation import segment_fingerprint
+from modules.fingerprint_enhancement import ENHANCEMENT_METHODS, gabor_enhance
+from modules.minutiae_pruning import prune_minutiae, PRUNABLE_THINNING_METHODS
+from modules.minutiae_matching import MINUTIAE_DTYPE, as_minutiae_array, match_minutiae_arrays, align_and_match
+from modules.fingerprint_template import (TEMPLATE_VERSION, ExtractionSettings, LEGACY_EXTRACTION,
+                                          prepare_template, serialize_template,
+                                          deserialize_prepared_template,
+                                          serialize_descriptor, deserialize_descriptor,
+                                          read_template_file, read_legacy_template)
+from modules.template_store import get_store, FINGERPRINT, FINGERPRINT_DESCRIPTOR
+from modules.template_cache import template_cache
+from modules.image_context import ImageContext
+from modules.fingerprint_index import get_fingerprint_index, index_fingerprint_template
+from modules.fingerprint_cascade import global_descriptor, fingerprint_cascade
+from modules.settings import (FINGERPRINT_THINNING_METHOD, FINGERPRINT_ENHANCEMENT,
+                              FINGERPRINT_SEGMENTATION, FINGERPRINT_PRUNING,
+                              FINGERPRINT_ALIGNMENT_HYPOTHESES, FINGERPRINT_INDEX_CANDIDATES,
+                              MIN_FINGERPRINT_MINUTIAE)
 
-def enhance_fingerprint(image):
-    """Enhance fingerprint image using various techniques"""
+def enhance_fingerprint(image, method=None):
+    """
+    Enhance fingerprint image using various techniques
+    
+    method is one of fingerprint_enhancement.ENHANCEMENT_METHODS (default:
+    FINGERPRINT_ENHANCEMENT): 'adaptive' thresholding or the oriented
+    'gabor' filter bank.
+    """
     # Convert to grayscale if needed
     if len(image.shape) == 3:
         gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
     else:
         gray = image.copy()
     
+    method = method or FINGERPRINT_ENHANCEMENT
+    if method == 'gabor':
+        return gabor_enhance(gray)
+    if method != 'adaptive':
+        raise ValueError(f"Unknown enhancement method: {method} (expected one of {ENHANCEMENT_METHODS})")
+    
     # Normalize
     normalized = cv2.normalize(gray, None, 0, 255, cv2.NORM_MINMAX)
     
@@ -32,54 +64,193 @@ def enhance_fingerprint(image):
 
 def extract_minutiae(image):
     """Extract fingerprint minutiae (ridge endings and bifurcations)"""
-    enhanced = enhance_fingerprint(image)
-    
-    # Apply thinning using morphological skeleton
-    size = np.size(enhanced)
-    skel = np.zeros(enhanced.shape, np.uint8)
-    element = cv2.getStructuringElement(cv2.MORPH_CROSS, (3, 3))
-    
-    done = False
-    temp = enhanced.copy()
-    while not done:
-        eroded = cv2.erode(temp, element)
-        opened = cv2.morphologyEx(eroded, cv2.MORPH_OPEN, element)
-        subset = eroded - opened
-        skel = cv2.bitwise_or(skel, subset)
-        temp = eroded.copy()
-        
-        zeros = size - cv2.countNonZero(temp)
-        if zeros == size:
-            done = True
+    return extract_fingerprint_features(image)['minutiae']
+
+def extract_fingerprint_features(image, thinning_method=None, segment=None, prune=None, enhancement=None):
+    """
+    Run the full fingerprint pipeline and keep its intermediate products
+    
+    Args:
+        image: Grayscale or BGR fingerprint image
+        thinning_method: One of thinning.THINNING_METHODS
+                         (default: FINGERPRINT_THINNING_METHOD)
+        segment: Crop to the ridge region and drop minutiae on the edge of
+                 the print (default: FINGERPRINT_SEGMENTATION)
+        prune: Remove spurious minutiae (default: FINGERPRINT_PRUNING);
+               only applied to PRUNABLE_THINNING_METHODS skeletons
+        enhancement: 'adaptive' or 'gabor' (default: FINGERPRINT_ENHANCEMENT)
+    
+    Returns:
+        dict with 'minutiae' (MINUTIAE_DTYPE array, full-image coordinates),
+        the thinned 'skeleton' and the smoothed 'orientation_field' of the
+        processed region so later stages can reuse them, the region 'roi'
+        as (top, bottom, left, right) and 'stats': pixels in the image and
+        actually processed, enhancement time, minutiae candidates,
+        candidates removed by pruning and minutiae kept. 'extraction' is
+        the ExtractionSettings actually used, as recorded in templates
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if len(image.shape) == 3 else image
+    h, w = gray.shape
+    top, bottom, left, right = 0, h, 0, w
+    inner = None
+    segment = bool(FINGERPRINT_SEGMENTATION if segment is None else segment)
+    enhancement = enhancement or FINGERPRINT_ENHANCEMENT
+    
+    # Foreground segmentation: background never reaches enhancement/thinning
+    if segment:
+        segmentation = segment_fingerprint(gray)
+        top, bottom, left, right = segmentation['roi']
+        gray = gray[top:bottom, left:right]
+        foreground = segmentation['mask'][top:bottom, left:right]
+        inner = segmentation['inner'][top:bottom, left:right]
+    
+    start = time.perf_counter()
+    enhanced = enhance_fingerprint(gray, enhancement)
+    enhancement_ms = (time.perf_counter() - start) * 1000
+    if inner is not None:
+        enhanced[~foreground] = 0
+    
+    # Thin ridges to a one-pixel skeleton
+    thinning_method = thinning_method or FINGERPRINT_THINNING_METHOD
+    skel = skeletonize(enhanced, thinning_method)
+    
+    # Orientation field computed once, sampled at every minutia
+    orientation_field = compute_orientation_field(skel)
     
     # Detect minutiae using crossing number method
-    minutiae = []
-    h, w = skel.shape
-    
-    for i in range(1, h - 1):
-        for j in range(1, w - 1):
-            if skel[i, j] == 255:  # Ridge pixel
-                # Calculate crossing number
-                cn = 0
-                neighbors = [
-                    skel[i-1, j], skel[i-1, j+1], skel[i, j+1], skel[i+1, j+1],
-                    skel[i+1, j], skel[i+1, j-1], skel[i, j-1], skel[i-1, j-1]
-                ]
-                
-                for k in range(8):
-                    cn += abs(int(neighbors[k] // 255) - int(neighbors[(k+1) % 8] // 255))
-                
-                cn = cn // 2
-                
-                # Ridge ending (cn = 1) or bifurcation (cn = 3)
-                if cn == 1 or cn == 3:
-                    minutiae.append({
-                        'position': (j, i),
-                        'type': 'ending' if cn == 1 else 'bifurcation',
-                        'orientation': calculate_orientation(skel, i, j)
-                    })
-    
-    return minutiae
+    crossing_map = crossing_number_map(skel)
+    rows, cols, crossing = detect_crossing_numbers(skel, crossing_map)
+    candidates = len(rows)
+    
+    # Drop spurs, bridges, broken ridges and clusters, then the print's edge
+    keep = np.ones(candidates, dtype=bool)
+    prune = (FINGERPRINT_PRUNING if prune is None else prune) and thinning_method in PRUNABLE_THINNING_METHODS
+    if prune:
+        keep = prune_minutiae(skel, crossing_map, rows, cols, crossing, orientation_field[rows, cols])
+    pruned = candidates - int(keep.sum())
+    if inner is not None:
+        keep &= inner[rows, cols]
+    rows, cols, crossing = rows[keep], cols[keep], crossing[keep]
+    
+    # Ridge ending (cn = 1) or bifurcation (cn = 3), type code = crossing number
+    minutiae = np.empty(len(rows), dtype=MINUTIAE_DTYPE)
+    minutiae['x'] = cols + left
+    minutiae['y'] = rows + top
+    minutiae['type'] = crossing
+    minutiae['angle'] = orientation_field[rows, cols]
+    
+    return {
+        'minutiae': minutiae,
+        'skeleton': skel,
+        'orientation_field': orientation_field,
+        'roi': (top, bottom, left, right),
+        'extraction': ExtractionSettings(thinning_method, prune, enhancement, segment),
+        'stats': {
+            'pixels_total': h * w,
+            'pixels_processed': (bottom - top) * (right - left),
+            'enhancement_ms': enhancement_ms,
+            'minutiae_candidates': candidates,
+            'minutiae_pruned': pruned,
+            'minutiae': len(minutiae)
+        }
+    }
+
+def current_extraction():
+    """ExtractionSettings a new enrollment gets under the current settings"""
+    pruned = FINGERPRINT_PRUNING and FINGERPRINT_THINNING_METHOD in PRUNABLE_THINNING_METHODS
+    return ExtractionSettings(FINGERPRINT_THINNING_METHOD, pruned, FINGERPRINT_ENHANCEMENT,
+                              bool(FINGERPRINT_SEGMENTATION))
+
+def _extract_like(image, extraction):
+    """extract_fingerprint_features with a template's ExtractionSettings"""
+    return extract_fingerprint_features(image, extraction.thinning_method, segment=extraction.segmented,
+                                        prune=extraction.pruned, enhancement=extraction.enhancement)
+
+def crossing_number_map(skel):
+    """
+    Compute the crossing number of every pixel of a skeleton in one pass
+    
+    The 8 neighbours are taken as shifted views of the binary skeleton in the
+    same clockwise order as the classic per-pixel loop (N, NE, E, SE, S, SW,
+    W, NW), so the result is identical to summing |P(k) - P(k+1)| / 2 pixel
+    by pixel. Border pixels and background pixels get a crossing number of 0.
+    
+    Returns:
+        uint8 array with the same shape as skel
+    """
+    ridge = (skel == 255).view(np.uint8)
+    h, w = ridge.shape
+    crossing = np.zeros((h, w), np.uint8)
+    if h < 3 or w < 3:
+        return crossing
+    
+    neighbors = [
+        ridge[0:h-2, 1:w-1], ridge[0:h-2, 2:w], ridge[1:h-1, 2:w], ridge[2:h, 2:w],
+        ridge[2:h, 1:w-1], ridge[2:h, 0:w-2], ridge[1:h-1, 0:w-2], ridge[0:h-2, 0:w-2]
+    ]
+    
+    transitions = np.zeros((h - 2, w - 2), np.uint8)
+    for k in range(8):
+        transitions += neighbors[k] ^ neighbors[(k + 1) % 8]
+    
+    crossing[1:h-1, 1:w-1] = (transitions // 2) * ridge[1:h-1, 1:w-1]
+    return crossing
+
+def detect_crossing_numbers(skel, crossing=None):
+    """
+    Locate ridge endings (cn = 1) and bifurcations (cn = 3) on a skeleton
+    
+    crossing may be a precomputed crossing_number_map(skel).
+    
+    Returns:
+        (rows, cols, crossing) arrays in row-major order, matching the order
+        of the original nested-loop scan
+    """
+    if crossing is None:
+        crossing = crossing_number_map(skel)
+    rows, cols = np.nonzero((crossing == 1) | (crossing == 3))
+    return rows, cols, crossing[rows, cols]
+
+@lru_cache(maxsize=8)
+def _orientation_kernels(window_size):
+    """
+    Fold Sobel + window sum into a pair of window_size x window_size kernels
+    
+    calculate_orientation runs Sobel on a cropped window (reflected at the
+    window edges) and sums the result. That is linear in the window pixels,
+    so the per-pixel weights can be read off once by feeding unit impulses.
+    """
+    kx = np.zeros((window_size, window_size), np.float32)
+    ky = np.zeros((window_size, window_size), np.float32)
+    impulse = np.zeros((window_size, window_size), np.float64)
+    
+    for a in range(window_size):
+        for b in range(window_size):
+            impulse[a, b] = 1.0
+            kx[a, b] = cv2.Sobel(impulse, cv2.CV_64F, 1, 0, ksize=3).sum()
+            ky[a, b] = cv2.Sobel(impulse, cv2.CV_64F, 0, 1, ksize=3).sum()
+            impulse[a, b] = 0.0
+    
+    return kx, ky
+
+def compute_orientation_field(image, window_size=5):
+    """
+    Compute the smoothed gradient orientation for every pixel of an image
+    
+    Gradients and their block sums are evaluated for the whole image with two
+    filter2D calls, giving the same angle calculate_orientation returns for a
+    single point (exactly for windows that fit inside the image).
+    
+    Returns:
+        float32 array of angles in radians, same shape as image
+    """
+    kx, ky = _orientation_kernels(window_size)
+    source = image.astype(np.float32)
+    
+    gx_sum = cv2.filter2D(source, cv2.CV_32F, kx, borderType=cv2.BORDER_CONSTANT)
+    gy_sum = cv2.filter2D(source, cv2.CV_32F, ky, borderType=cv2.BORDER_CONSTANT)
+    
+    return np.arctan2(gy_sum, gx_sum)
 
 def calculate_orientation(image, i, j, window_size=5):
     """Calculate ridge orientation at a point"""
@@ -101,73 +272,114 @@ def calculate_orientation(image, i, j, window_size=5):
     orientation = np.arctan2(gy.sum(), gx.sum())
     return orientation
 
-def match_minutiae(minutiae1, minutiae2, threshold=0.7):
-    """Match two sets of minutiae using spatial and orientation similarity"""
+def match_minutiae(minutiae1, minutiae2, threshold=0.7, tolerance_distance=20, tolerance_angle=np.pi / 6,
+                   align=True):
+    """
+    Match two sets of minutiae using spatial and orientation similarity
+    
+    Minutiae may be legacy lists of dicts or structured arrays. Each stored
+    minutia can match at most one probe minutia (and vice versa). With
+    align=True the probe is first aligned to minutiae1 (rotation and
+    translation) by Hough voting.
+    """
     if len(minutiae1) == 0 or len(minutiae2) == 0:
         return 0.0
     
-    matches = 0
-    tolerance_distance = 20  # pixels
-    tolerance_angle = np.pi / 6  # 30 degrees
-    
-    for m1 in minutiae1:
-        for m2 in minutiae2:
-            # Check type match
-            if m1['type'] != m2['type']:
-                continue
-            
-            # Check spatial distance
-            dist = np.sqrt(
-                (m1['position'][0] - m2['position'][0]) ** 2 +
-                (m1['position'][1] - m2['position'][1]) ** 2
-            )
-            
-            if dist > tolerance_distance:
-                continue
-            
-            # Check orientation
-            angle_diff = abs(m1['orientation'] - m2['orientation'])
-            angle_diff = min(angle_diff, 2 * np.pi - angle_diff)
-            
-            if angle_diff < tolerance_angle:
-                matches += 1
-                break
-    
-    # Calculate match score
-    score = matches / max(len(minutiae1), len(minutiae2))
-    return score
+    stored = as_minutiae_array(minutiae1)
+    probe = as_minutiae_array(minutiae2)
+    if not align:
+        return match_minutiae_arrays(stored, probe, tolerance_distance, tolerance_angle)
+    
+    details = align_and_match(stored, probe, tolerance_distance=tolerance_distance,
+                              tolerance_angle=tolerance_angle,
+                              max_hypotheses=FINGERPRINT_ALIGNMENT_HYPOTHESES)
+    return details['score']
 
 def save_fingerprint_template(image, user_id="default_user"):
-    """Extract and save fingerprint minutiae"""
-    minutiae = extract_minutiae(image)
+    """
+    Extract and save fingerprint minutiae to the template store
     
-    os.makedirs("database", exist_ok=True)
-    filepath = f"database/fingerprint_{user_id}.pkl"
+    The template is stored match-ready (minutiae grouped by type, grid
+    index and neighbourhood keys), so verification only does probe-side work.
+    It records the thinning method, pruning, enhancement and segmentation
+    it was extracted with; probes are extracted the same way.
     
-    with open(filepath, 'wb') as f:
-        pickle.dump(minutiae, f)
+    Raises:
+        ValueError: fewer than MIN_FINGERPRINT_MINUTIAE minutiae survive pruning
+    """
+    features = extract_fingerprint_features(image)
+    minutiae = features['minutiae']
+    if len(minutiae) < MIN_FINGERPRINT_MINUTIAE:
+        raise ValueError(f"Only {len(minutiae)} minutiae found (at least {MIN_FINGERPRINT_MINUTIAE} needed). "
+                         "Please upload a clearer fingerprint image.")
+    prepared = prepare_template(minutiae, extraction=features['extraction'])
+    
+    get_store().put_many([
+        (user_id, FINGERPRINT, serialize_template(prepared)),
+        (user_id, FINGERPRINT_DESCRIPTOR, serialize_descriptor(global_descriptor(minutiae)))
+    ])
+    template_cache.invalidate((FINGERPRINT, user_id))
+    template_cache.invalidate((FINGERPRINT_DESCRIPTOR, user_id))
+    index_fingerprint_template(user_id, prepared)
     
     print(f"✅ Fingerprint template saved for user: {user_id} ({len(minutiae)} minutiae)")
 
 def load_fingerprint_template(user_id="default_user"):
-    """Load fingerprint minutiae from database"""
-    filepath = f"database/fingerprint_{user_id}.pkl"
-    if not os.path.exists(filepath):
-        return None
+    """
+    Load fingerprint minutiae (served from the in-process template cache
+    while the user's stored template is unchanged)
     
-    with open(filepath, 'rb') as f:
-        return pickle.load(f)
+    Returns a read-only MINUTIAE_DTYPE array.
+    """
+    prepared = load_prepared_template(user_id)
+    return None if prepared is None else prepared.minutiae
 
-def verify_fingerprint(image, threshold=0.3, user_id="default_user"):
+def load_prepared_template(user_id="default_user"):
     """
-    Verify fingerprint against stored template
-    Returns tuple: (passed: bool, match_score: float)
+    Load the match-ready PreparedTemplate for a user (None if not enrolled)
+    
+    Templates stored in an older format are upgraded in the store on first
+    load.
     """
-    # Load stored template
-    stored_minutiae = load_fingerprint_template(user_id)
-    if stored_minutiae is None:
-        print("⚠️ No fingerprint template found. Please enroll first.")
-        return False, 0.0
+    store = get_store()
+    prepared = template_cache.get((FINGERPRINT, user_id), lambda: _read_fingerprint_template(store, user_id),
+                                  stamp=store.version(user_id, FINGERPRINT))
+    if prepared is not None and prepared.version < TEMPLATE_VERSION:
+        prepared = _upgrade_fingerprint_template(store, user_id, prepared)
+    return prepared
+
+def _upgrade_fingerprint_template(store, user_id, prepared):
+    """
+    Rewrite an older-format template in the current format and cache the
+    result under the row version the rewrite produced
+    """
+    data = serialize_template(prepared)
+    store.put(user_id, FINGERPRINT, data)
+    return template_cache.put((FINGERPRINT, user_id), deserialize_prepared_template(data),
+                              stamp=store.version(user_id, FINGERPRINT))
+
+def _read_fingerprint_template(store, user_id):
+    """
+    Read a fingerprint template from the template store. Users not yet
+    migrated are read from database/fingerprint_<user>.fpt or the legacy
+    pickled .pkl file.
+    """
+    data = store.get(user_id, FINGERPRINT)
+    if data is not None:
+        return deserialize_prepared_template(data)
+    
+    filepath = f"database/fingerprint_{user_id}.fpt"
+    legacy_path = f"database/fingerprint_{user_id}.pkl"
+    if os.path.exists(filepath):
+        return prepare_template(read_template_file(filepath))
+    if os.path.exists(legacy_path):
+        return prepare_template(read_legacy_template(legacy_path))
+    return None
+
+def _to_grayscale(image):
+    """Decode a Streamlit UploadedFile, encoded bytes or ImageContext into a grayscale array"""
+    if isinstance(image, ImageContext):
+        return image.gray
     
     # Convert Streamlit UploadedFile to numpy array
     if hasattr(image, 'read'):
@@ -182,17 +394,123 @@ def verify_fingerprint(image, threshold=0.3, user_id="default_user"):
     if isinstance(image, bytes):
         nparr = np.frombuffer(image, np.uint8)
         image = cv2.imdecode(nparr, cv2.IMREAD_GRAYSCALE)
+    return image
+
+def load_fingerprint_descriptor(user_id="default_user"):
+    """
+    Global descriptor stored at enrollment (computed from the template for
+    users enrolled before descriptors existed); None if not enrolled
+    """
+    store = get_store()
+    
+    def _read():
+        data = store.get(user_id, FINGERPRINT_DESCRIPTOR)
+        if data is not None:
+            return deserialize_descriptor(data)
+        minutiae = load_fingerprint_template(user_id)
+        return None if minutiae is None else global_descriptor(minutiae)
     
-    # Extract minutiae from input
-    current_minutiae = extract_minutiae(image)
+    return template_cache.get((FINGERPRINT_DESCRIPTOR, user_id), _read,
+                              stamp=store.version(user_id, FINGERPRINT_DESCRIPTOR))
+
+def verify_fingerprint(image, threshold=0.3, user_id="default_user", return_details=False):
+    """
+    Verify fingerprint against stored template
+    Returns tuple: (passed: bool, match_score: float)
+    
+    image may also be an ImageContext, whose cached grayscale is used.
+    
+    The probe is extracted with the thinning method, pruning, enhancement
+    and segmentation recorded in the template (LEGACY_EXTRACTION for templates that predate recorded
+    settings). Global descriptors go through the comparison cascade first;
+    a probe rejected there scores 0.0 without full matching.
+    
+    With return_details=True a third element is returned: a dict with the
+    extraction time and pixel/minutiae counts, the extraction settings used
+    ('extraction_settings') and 'reenroll' (True if they differ from
+    current_extraction(), so re-enrolling would change the template), the
+    rejecting cascade stage ('rejected_by', or None) and the
+    alignment/scoring breakdown from align_and_match.
+    """
+    details = {}
+    
+    def _result(passed, score):
+        return (passed, score, details) if return_details else (passed, score)
+    
+    # Load stored (match-ready) template
+    stored = load_prepared_template(user_id)
+    if stored is None:
+        print("⚠️ No fingerprint template found. Please enroll first.")
+        return _result(False, 0.0)
+    
+    image = _to_grayscale(image)
+    
+    # Extract minutiae from input the way the template was extracted
+    extraction = stored.extraction or LEGACY_EXTRACTION
+    details['reenroll'] = extraction != current_extraction()
+    start = time.perf_counter()
+    features = _extract_like(image, extraction)
+    current_minutiae = features['minutiae']
+    details['extraction_ms'] = (time.perf_counter() - start) * 1000
+    details['extraction'] = features['stats']
+    details['extraction_settings'] = features['extraction']
     if len(current_minutiae) == 0:
         print("❌ No minutiae detected in fingerprint")
-        return False, 0.0
+        return _result(False, 0.0)
+    
+    # Cheap descriptor stages first: obvious non-matches never reach the matcher
+    details['rejected_by'] = fingerprint_cascade.prefilter(
+        load_fingerprint_descriptor(user_id), global_descriptor(current_minutiae)
+    )
+    if details['rejected_by'] is not None:
+        print(f"❌ Fingerprint rejected by {details['rejected_by']} prefilter")
+        return _result(False, 0.0)
     
-    # Match minutiae
-    score = match_minutiae(stored_minutiae, current_minutiae)
+    # Align, then match minutiae (stops retrying once the threshold is met)
+    start = time.perf_counter()
+    match = align_and_match(
+        stored.minutiae, current_minutiae, threshold=threshold,
+        max_hypotheses=FINGERPRINT_ALIGNMENT_HYPOTHESES, index=stored.index
+    )
+    details.update(match)
+    score = match['score']
     passed = score >= threshold
+    fingerprint_cascade.record('match', time.perf_counter() - start, rejected=not passed)
     
     print(f"Fingerprint match score: {score:.3f} (threshold: {threshold}) - {'PASS' if passed else 'FAIL'}")
     
-    return passed, float(score)
\ No newline at end of file
+    return _result(passed, float(score))
+
+def identify_fingerprint(image, top_k=5, candidates=FINGERPRINT_INDEX_CANDIDATES):
+    """
+    1:N identification: who does this fingerprint belong to?
+    
+    The geometric-hashing index narrows the enrolled users down to a short
+    candidate list; only those templates go through the full matcher, each
+    against the probe extracted with the template's recorded settings.
+    
+    Returns:
+        list of (user_id, match_score) tuples, best first
+    """
+    image = _to_grayscale(image)
+    features = extract_fingerprint_features(image)
+    probe = features['minutiae']
+    if len(probe) == 0:
+        return []
+    
+    # Probe minutiae per extraction setting, extracted once each
+    probes = {features['extraction']: probe}
+    results = []
+    for user_id, _ in get_fingerprint_index().candidates(probe, candidates):
+        stored = load_prepared_template(user_id)
+        if stored is None:
+            continue
+        extraction = stored.extraction or LEGACY_EXTRACTION
+        if extraction not in probes:
+            probes[extraction] = _extract_like(image, extraction)['minutiae']
+        match = align_and_match(stored.minutiae, probes[extraction], max_hypotheses=FINGERPRINT_ALIGNMENT_HYPOTHESES,
+                                index=stored.index)
+        results.append((user_id, float(match['score'])))
+    
+    results.sort(key=lambda item: item[1], reverse=True)
+    return results[:top_k]
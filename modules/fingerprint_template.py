@@ -0,0 +1,173 @@
+import pickle
+import struct
+from collections import namedtuple
+import numpy as np
+from modules.minutiae_matching import MINUTIAE_DTYPE, GridIndex, as_minutiae_array
+from modules.fingerprint_index import pair_keys
+from modules.fingerprint_cascade import DESCRIPTOR_DTYPE
+from modules.thinning import THINNING_METHODS
+from modules.fingerprint_enhancement import ENHANCEMENT_METHODS
+
+# On-disk layout: fixed header followed by packed MINUTIAE_DTYPE records
+#   magic (4s) | format version (uint16) | minutiae count (uint32) | records
+# Version 2 appends match-ready data computed at enrollment (records are
+# grouped by type), each array starting on an 8-byte boundary:
+#   grid cell size (float32) | pair key count (uint32) | 8 reserved bytes
+#   grid order (int32 x count) | sorted grid keys (int64 x count) | pair keys (int64)
+# Version 3 records the extraction settings in the first four reserved bytes:
+#   thinning method (uint8, 1 + index in THINNING_METHODS, 0 = unknown) | pruned (uint8)
+#   enhancement (uint8, 1 + index in ENHANCEMENT_METHODS, 0 = unknown) | segmented (uint8)
+TEMPLATE_MAGIC = b"FPMT"
+TEMPLATE_VERSION = 3
+_HEADER = struct.Struct("<4sHI")
+_MATCH_HEADER = struct.Struct("<fIBBBB4x")
+
+# Settings that change which minutiae extract_fingerprint_features finds;
+# probes must be extracted with the same ones as the template
+ExtractionSettings = namedtuple('ExtractionSettings', ('thinning_method', 'pruned', 'enhancement', 'segmented'))
+
+# Extraction assumed for templates without recorded settings: the original
+# pipeline, which never segmented or pruned
+LEGACY_EXTRACTION = ExtractionSettings('morphological', False, 'adaptive', False)
+
+# Grid cell size saved with the template (align_and_match's default tolerance)
+MATCH_CELL_SIZE = 20
+
+# Global descriptor blob: magic (4s) | format version (uint16) | one DESCRIPTOR_DTYPE record
+DESCRIPTOR_MAGIC = b"FPGD"
+DESCRIPTOR_VERSION = 1
+_DESCRIPTOR_HEADER = struct.Struct("<4sH")
+
+class PreparedTemplate:
+    """
+    Enrolled minutiae plus everything the matcher needs from the stored side
+
+    minutiae are grouped by type (endings first), index is a GridIndex over
+    their positions and pair_keys are the neighbourhood hash keys used by the
+    identification index, so verification only does probe-side work.
+    extraction is the ExtractionSettings the minutiae were extracted with,
+    or None when the template predates version 3.
+    """
+    __slots__ = ('minutiae', 'index', 'pair_keys', 'extraction', 'version')
+
+    def __init__(self, minutiae, index, pair_keys, extraction=None, version=TEMPLATE_VERSION):
+        self.minutiae = minutiae
+        self.index = index
+        self.pair_keys = pair_keys
+        self.extraction = extraction
+        self.version = version
+
+    def __len__(self):
+        return len(self.minutiae)
+
+    @property
+    def nbytes(self):
+        return self.minutiae.nbytes + self.index.nbytes + self.pair_keys.nbytes
+
+def prepare_template(minutiae, cell_size=MATCH_CELL_SIZE, extraction=None):
+    """Compute the match-ready form of a minutiae set (extraction: see PreparedTemplate)"""
+    records = as_minutiae_array(minutiae)
+    records = records[np.argsort(records['type'], kind='stable')]
+    index = GridIndex(np.column_stack((records['x'], records['y'])), cell_size)
+    return PreparedTemplate(records, index, pair_keys(records), extraction)
+
+def _padding(size):
+    return -size % 8
+
+def serialize_template(minutiae):
+    """Pack minutiae (or a PreparedTemplate) into the versioned binary template format"""
+    prepared = minutiae if isinstance(minutiae, PreparedTemplate) else prepare_template(minutiae)
+    records = np.ascontiguousarray(prepared.minutiae)
+
+    parts = [_HEADER.pack(TEMPLATE_MAGIC, TEMPLATE_VERSION, len(records)), records.tobytes()]
+    parts.append(b"\0" * _padding(_HEADER.size + records.nbytes))
+    settings = (0, False, 0, False)
+    if prepared.extraction is not None:
+        method, pruned, enhancement, segmented = prepared.extraction
+        settings = (THINNING_METHODS.index(method) + 1, pruned, ENHANCEMENT_METHODS.index(enhancement) + 1, segmented)
+    parts.append(_MATCH_HEADER.pack(prepared.index.cell_size, len(prepared.pair_keys), *settings))
+    order = prepared.index.order.astype('<i4')
+    parts.append(order.tobytes() + b"\0" * _padding(order.nbytes))
+    parts.append(prepared.index.sorted_keys.astype('<i8').tobytes())
+    parts.append(prepared.pair_keys.astype('<i8').tobytes())
+    return b"".join(parts)
+
+def _unpack_header(data):
+    if len(data) < _HEADER.size:
+        raise ValueError("Fingerprint template is truncated")
+
+    magic, version, count = _HEADER.unpack_from(data)
+    if magic != TEMPLATE_MAGIC:
+        raise ValueError("Not a fingerprint template")
+    if version > TEMPLATE_VERSION:
+        raise ValueError(f"Unsupported fingerprint template version: {version}")
+    return version, count
+
+def deserialize_template(data):
+    """
+    Unpack a binary template (any version) into a MINUTIAE_DTYPE array
+
+    The array is a read-only view over data (no copy).
+    """
+    _, count = _unpack_header(data)
+    return np.frombuffer(data, dtype=MINUTIAE_DTYPE, count=count, offset=_HEADER.size)
+
+def deserialize_prepared_template(data):
+    """
+    Unpack a binary template into a PreparedTemplate
+
+    Version 2+ templates are read as zero-copy views; older versions are
+    prepared on the fly (check .version to upgrade the stored copy).
+    Templates before version 3 have unknown extraction settings.
+    """
+    version, count = _unpack_header(data)
+    minutiae = np.frombuffer(data, dtype=MINUTIAE_DTYPE, count=count, offset=_HEADER.size)
+    if version < 2:
+        prepared = prepare_template(minutiae)
+        prepared.version = version
+        return prepared
+
+    offset = _HEADER.size + minutiae.nbytes
+    offset += _padding(offset)
+    cell_size, n_pairs, method_code, pruned, enhancement_code, segmented = _MATCH_HEADER.unpack_from(data, offset)
+    extraction = None
+    if version >= 3 and method_code and enhancement_code:
+        extraction = ExtractionSettings(THINNING_METHODS[method_code - 1], bool(pruned),
+                                        ENHANCEMENT_METHODS[enhancement_code - 1], bool(segmented))
+    offset += _MATCH_HEADER.size
+    order = np.frombuffer(data, dtype='<i4', count=count, offset=offset)
+    offset += order.nbytes + _padding(order.nbytes)
+    sorted_keys = np.frombuffer(data, dtype='<i8', count=count, offset=offset)
+    offset += sorted_keys.nbytes
+    keys = np.frombuffer(data, dtype='<i8', count=n_pairs, offset=offset)
+
+    index = GridIndex.from_sorted(np.column_stack((minutiae['x'], minutiae['y'])), cell_size, order, sorted_keys)
+    return PreparedTemplate(minutiae, index, keys, extraction, version)
+
+def serialize_descriptor(descriptor):
+    """Pack a global fingerprint descriptor (see fingerprint_cascade.global_descriptor)"""
+    record = np.asarray(descriptor, dtype=DESCRIPTOR_DTYPE).reshape(())
+    return _DESCRIPTOR_HEADER.pack(DESCRIPTOR_MAGIC, DESCRIPTOR_VERSION) + record.tobytes()
+
+def deserialize_descriptor(data):
+    """Unpack a global descriptor into a read-only 0-d DESCRIPTOR_DTYPE array"""
+    if len(data) < _DESCRIPTOR_HEADER.size + DESCRIPTOR_DTYPE.itemsize:
+        raise ValueError("Fingerprint descriptor is truncated")
+
+    magic, version = _DESCRIPTOR_HEADER.unpack_from(data)
+    if magic != DESCRIPTOR_MAGIC:
+        raise ValueError("Not a fingerprint descriptor")
+    if version > DESCRIPTOR_VERSION:
+        raise ValueError(f"Unsupported fingerprint descriptor version: {version}")
+
+    return np.frombuffer(data, dtype=DESCRIPTOR_DTYPE, count=1, offset=_DESCRIPTOR_HEADER.size).reshape(())
+
+def read_template_file(filepath):
+    """Read a binary template file"""
+    with open(filepath, 'rb') as f:
+        return deserialize_template(f.read())
+
+def read_legacy_template(filepath):
+    """Read a pickled list-of-dicts template and convert it to the array format"""
+    with open(filepath, 'rb') as f:
+        return as_minutiae_array(pickle.load(f))
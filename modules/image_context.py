@@ -0,0 +1,93 @@
+import cv2
+import numpy as np
+from functools import cached_property
+
+class ImageContext:
+    """
+    One request's image, decoded once, with its derived products cached
+
+    Accepts a Streamlit UploadedFile (or any file-like object PIL can
+    open), encoded bytes, a numpy array (BGR, BGRA or grayscale) or another
+    ImageContext. Color conversions, the detected face box and the Face
+    Mesh landmarks are computed on first use and shared by every stage the
+    context is passed to (check_liveness, verify_face, verify_fingerprint).
+    """
+
+    def __init__(self, source):
+        if isinstance(source, ImageContext):
+            self._pixels, self._order = source._pixels, source._order
+            return
+
+        # Convert Streamlit UploadedFile to numpy array
+        if hasattr(source, 'read'):
+            from PIL import Image
+            pil_image = Image.open(source)
+            if pil_image.mode not in ('L', 'RGB'):
+                pil_image = pil_image.convert('RGB')
+            self._pixels = np.array(pil_image)
+            self._order = 'GRAY' if pil_image.mode == 'L' else 'RGB'
+            return
+
+        # Convert image from bytes if needed
+        if isinstance(source, bytes):
+            source = cv2.imdecode(np.frombuffer(source, np.uint8), cv2.IMREAD_COLOR)
+            if source is None:
+                raise ValueError("Could not decode image")
+
+        if source.ndim == 3 and source.shape[2] == 4:
+            source = cv2.cvtColor(source, cv2.COLOR_BGRA2BGR)
+        self._pixels = source
+        self._order = 'GRAY' if source.ndim == 2 else 'BGR'
+
+    @classmethod
+    def of(cls, image):
+        """image itself if it already is an ImageContext, else a new context for it"""
+        return image if isinstance(image, cls) else cls(image)
+
+    @property
+    def shape(self):
+        """Shape of the decoded image"""
+        return self._pixels.shape
+
+    @cached_property
+    def bgr(self):
+        """3-channel BGR image (what OpenCV-based stages expect)"""
+        if self._order == 'BGR':
+            return self._pixels
+        code = cv2.COLOR_RGB2BGR if self._order == 'RGB' else cv2.COLOR_GRAY2BGR
+        return cv2.cvtColor(self._pixels, code)
+
+    @cached_property
+    def rgb(self):
+        """3-channel RGB image (what MediaPipe expects)"""
+        if self._order == 'RGB':
+            return self._pixels
+        code = cv2.COLOR_BGR2RGB if self._order == 'BGR' else cv2.COLOR_GRAY2RGB
+        return cv2.cvtColor(self._pixels, code)
+
+    @cached_property
+    def gray(self):
+        """Single-channel grayscale image"""
+        if self._order == 'GRAY':
+            return self._pixels
+        code = cv2.COLOR_RGB2GRAY if self._order == 'RGB' else cv2.COLOR_BGR2GRAY
+        return cv2.cvtColor(self._pixels, code)
+
+    @cached_property
+    def faces(self):
+        """All face boxes (x, y, w, h) from the downscaled Haar detector"""
+        from modules.face_recognition import detect_faces
+        return detect_faces(self.gray)
+
+    @cached_property
+    def face_box(self):
+        """Largest detected face box (x, y, w, h), or None"""
+        if len(self.faces) == 0:
+            return None
+        return tuple(int(v) for v in max(self.faces, key=lambda rect: rect[2] * rect[3]))
+
+    @cached_property
+    def landmarks(self):
+        """Face Mesh landmarks (liveness_detection.FaceLandmarks), or None"""
+        from modules.liveness_detection import detect_landmarks
+        return detect_landmarks(self.rgb, is_rgb=True)
@@ -1,141 +1,329 @@
 import cv2
+import time
+import threading
 import numpy as np
 import mediapipe as mp
+from modules.image_context import ImageContext
+from modules.settings import (LIVENESS_BLINK_EAR_THRESHOLD, LIVENESS_BLINK_MIN_FRAMES,
+                              LIVENESS_BLINK_MAX_FRAMES, LIVENESS_VIDEO_REQUIRED_BLINKS,
+                              LIVENESS_VIDEO_MAX_FRAMES, LIVENESS_TEXTURE_THRESHOLD, LIVENESS_TEXTURE_SIZE)
 
-# Initialize MediaPipe Face Mesh
+# Initialize MediaPipe Face Mesh for independent still images; video
+# streams get their own mesh in tracking mode (see check_liveness_video)
 mp_face_mesh = mp.solutions.face_mesh
 face_mesh = mp_face_mesh.FaceMesh(
+    static_image_mode=True,
     max_num_faces=1,
     refine_landmarks=True,
-    min_detection_confidence=0.5,
-    min_tracking_confidence=0.5
+    min_detection_confidence=0.5
 )
 
 # Eye landmarks indices for MediaPipe Face Mesh
 LEFT_EYE_INDICES = [33, 160, 158, 133, 153, 144]
 RIGHT_EYE_INDICES = [362, 385, 387, 263, 373, 380]
 
-def calculate_ear(eye_landmarks):
-    """Calculate Eye Aspect Ratio (EAR)"""
-    # Vertical distances
-    v1 = np.linalg.norm(eye_landmarks[1] - eye_landmarks[5])
-    v2 = np.linalg.norm(eye_landmarks[2] - eye_landmarks[4])
+# Nose tip and forehead landmarks used for the depth estimate
+NOSE_INDEX = 1
+FOREHEAD_INDEX = 10
+
+# face_mesh keeps graph state between calls; one image at a time
+_face_mesh_lock = threading.Lock()
+
+class FaceLandmarks:
+    """
+    Face Mesh landmarks of one image, shared by every landmark-based check
     
-    # Horizontal distance
-    h = np.linalg.norm(eye_landmarks[0] - eye_landmarks[3])
+    coords is an (N, 3) float64 array of MediaPipe's normalized x, y, z;
+    width and height are the size of the image they were detected on.
+    """
     
-    # Eye Aspect Ratio
-    ear = (v1 + v2) / (2.0 * h)
-    return ear
+    def __init__(self, coords, width, height):
+        self.coords = coords
+        self.width = width
+        self.height = height
+    
+    def pixels(self, indices):
+        """(len(indices), 2) array of landmark positions in image pixels"""
+        return self.coords[indices, :2] * np.array([self.width, self.height], np.float64)
+    
+    def depth(self, index):
+        """Normalized z of one landmark"""
+        return float(self.coords[index, 2])
+    
+    def bounding_box(self):
+        """(x, y, w, h) pixel box around all landmarks, clipped to the image"""
+        points = self.pixels(slice(None))
+        x0, y0 = np.clip(np.floor(points.min(axis=0)), 0, None).astype(int)
+        x1 = min(int(np.ceil(points[:, 0].max())), self.width)
+        y1 = min(int(np.ceil(points[:, 1].max())), self.height)
+        return x0, y0, max(x1 - x0, 0), max(y1 - y0, 0)
 
-def detect_blink(image, ear_threshold=0.2):
-    """Detect if eyes are closed (potential blink)"""
+def detect_landmarks(image, mesh=None, is_rgb=False):
+    """
+    Run Face Mesh once on an image
+    
+    mesh defaults to the shared still-image face_mesh; a video stream
+    passes its own tracking-mode FaceMesh. is_rgb=True skips the color
+    conversion for an image that is already RGB.
+    
+    Returns:
+        FaceLandmarks of the first face, or None if no face is found
+    """
     # Convert to RGB for MediaPipe
-    if len(image.shape) == 2:
+    if is_rgb:
+        image_rgb = image
+    elif len(image.shape) == 2:
         image_rgb = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
     elif image.shape[2] == 4:
         image_rgb = cv2.cvtColor(image, cv2.COLOR_BGRA2RGB)
     else:
         image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
     
-    # Process image
-    results = face_mesh.process(image_rgb)
+    if mesh is None:
+        with _face_mesh_lock:
+            results = face_mesh.process(image_rgb)
+    else:
+        results = mesh.process(image_rgb)
     
     if not results.multi_face_landmarks:
-        return None, "No face detected"
+        return None
     
-    face_landmarks = results.multi_face_landmarks[0]
+    landmarks = results.multi_face_landmarks[0].landmark
+    coords = np.array([(point.x, point.y, point.z) for point in landmarks], dtype=np.float64)
     h, w = image.shape[:2]
+    return FaceLandmarks(coords, w, h)
+
+def calculate_ear(eye_landmarks):
+    """Calculate Eye Aspect Ratio (EAR)"""
+    # Vertical distances
+    v1 = np.linalg.norm(eye_landmarks[1] - eye_landmarks[5])
+    v2 = np.linalg.norm(eye_landmarks[2] - eye_landmarks[4])
     
-    # Extract eye landmarks
-    left_eye = []
-    for idx in LEFT_EYE_INDICES:
-        landmark = face_landmarks.landmark[idx]
-        left_eye.append([landmark.x * w, landmark.y * h])
-    left_eye = np.array(left_eye)
+    # Horizontal distance
+    h = np.linalg.norm(eye_landmarks[0] - eye_landmarks[3])
     
-    right_eye = []
-    for idx in RIGHT_EYE_INDICES:
-        landmark = face_landmarks.landmark[idx]
-        right_eye.append([landmark.x * w, landmark.y * h])
-    right_eye = np.array(right_eye)
+    # Eye Aspect Ratio
+    ear = (v1 + v2) / (2.0 * h)
+    return ear
+
+def detect_blink(image, ear_threshold=0.2, landmarks=None):
+    """
+    Detect if eyes are closed (potential blink)
+    
+    landmarks may be a FaceLandmarks already computed for image.
+    """
+    if landmarks is None:
+        landmarks = detect_landmarks(image)
+    if landmarks is None:
+        return None, "No face detected"
     
     # Calculate EAR for both eyes
-    left_ear = calculate_ear(left_eye)
-    right_ear = calculate_ear(right_eye)
+    left_ear = calculate_ear(landmarks.pixels(LEFT_EYE_INDICES))
+    right_ear = calculate_ear(landmarks.pixels(RIGHT_EYE_INDICES))
     avg_ear = (left_ear + right_ear) / 2.0
     
     is_closed = avg_ear < ear_threshold
     
     return is_closed, avg_ear
 
-def detect_texture(image):
-    """Detect texture patterns to distinguish real face from photo"""
-    # Convert to grayscale
-    if len(image.shape) == 3:
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    else:
-        gray = image.copy()
+class BlinkTracker:
+    """
+    Streaming blink detector over per-frame eye aspect ratios
     
-    # Calculate Laplacian variance (measure of image sharpness/blur)
-    laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
+    A blink is a run of min_frames to max_frames consecutive closed frames
+    (EAR below ear_threshold) followed by an open frame. Frames without a
+    face interrupt a run without completing it.
+    """
     
-    # Real faces typically have more texture variation
-    # Photos of faces tend to be flatter/blurrier
-    return laplacian_var
+    def __init__(self, ear_threshold=LIVENESS_BLINK_EAR_THRESHOLD, min_frames=LIVENESS_BLINK_MIN_FRAMES,
+                 max_frames=LIVENESS_BLINK_MAX_FRAMES):
+        self.ear_threshold = ear_threshold
+        self.min_frames = min_frames
+        self.max_frames = max_frames
+        self.blinks = 0
+        self.open_frames = 0
+        self.closed_run = 0
+    
+    def update(self, ear):
+        """
+        Account one frame (ear is None when no face was found)
+        
+        Returns:
+            True if this frame completed a blink
+        """
+        if ear is None:
+            self.closed_run = 0
+            return False
+        if ear < self.ear_threshold:
+            self.closed_run += 1
+            return False
+        
+        self.open_frames += 1
+        blinked = self.min_frames <= self.closed_run <= self.max_frames
+        self.closed_run = 0
+        self.blinks += blinked
+        return blinked
 
-def detect_face_depth(image):
-    """Estimate depth using face size and position"""
-    # Convert to RGB for MediaPipe
-    if len(image.shape) == 2:
-        image_rgb = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
-    elif image.shape[2] == 4:
-        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGRA2RGB)
-    else:
-        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+def _video_frames(source):
+    """Yield BGR frames from a video file path / camera index or any frame iterable"""
+    if not isinstance(source, (str, int)):
+        yield from source
+        return
     
-    results = face_mesh.process(image_rgb)
+    capture = cv2.VideoCapture(source)
+    try:
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                return
+            yield frame
+    finally:
+        capture.release()
+
+def check_liveness_video(source, required_blinks=LIVENESS_VIDEO_REQUIRED_BLINKS,
+                         max_frames=LIVENESS_VIDEO_MAX_FRAMES, return_details=False):
+    """
+    Temporal liveness detection: watch a video for real blinks
     
-    if not results.multi_face_landmarks:
-        return 0.0
+    Frames are read from a video file, camera index or frame iterator and
+    run through a Face Mesh in tracking mode. Eye aspect ratio is tracked
+    over time and the stream is abandoned as soon as required_blinks blinks
+    are seen (live) or after max_frames frames (not live).
     
-    face_landmarks = results.multi_face_landmarks[0]
-    h, w = image.shape[:2]
+    Returns:
+        is_live, or (is_live, details) with return_details=True; details
+        holds the blink count, frames consumed, frames with a face, the EAR
+        range and the time to decision
+    """
+    tracker = BlinkTracker()
+    frames = 0
+    face_frames = 0
+    ears = []
+    start = time.perf_counter()
+    
+    with mp_face_mesh.FaceMesh(
+        static_image_mode=False,
+        max_num_faces=1,
+        refine_landmarks=True,
+        min_detection_confidence=0.5,
+        min_tracking_confidence=0.5
+    ) as mesh:
+        for frame in _video_frames(source):
+            frames += 1
+            ear = None
+            landmarks = detect_landmarks(frame, mesh=mesh)
+            if landmarks is not None:
+                face_frames += 1
+                _, ear = detect_blink(frame, tracker.ear_threshold, landmarks=landmarks)
+                ears.append(float(ear))
+            tracker.update(ear)
+            
+            if tracker.blinks >= required_blinks or frames >= max_frames:
+                break
+    
+    is_live = tracker.blinks >= required_blinks
+    details = {
+        'is_live': is_live,
+        'blinks': tracker.blinks,
+        'frames': frames,
+        'face_frames': face_frames,
+        'ear_min': min(ears) if ears else 0.0,
+        'ear_max': max(ears) if ears else 0.0,
+        'decision_ms': (time.perf_counter() - start) * 1000
+    }
     
-    # Get nose tip (landmark 1) and forehead (landmark 10)
-    nose = face_landmarks.landmark[1]
-    forehead = face_landmarks.landmark[10]
+    print(f"Video liveness: {tracker.blinks} blink(s) in {frames} frames "
+          f"({details['decision_ms']:.0f} ms) - {'LIVE' if is_live else 'SPOOFED'}")
     
-    # Calculate z-depth difference (rough 3D estimate)
-    depth_diff = abs(nose.z - forehead.z)
+    return (is_live, details) if return_details else is_live
+
+def face_region(image, landmarks=None):
+    """
+    Face box for texture analysis: from landmarks when available, else from
+    the (downscaled) face detector; None if no face is found
+    
+    image may be an ImageContext, whose cached face box is then reused.
+    """
+    if landmarks is not None:
+        box = landmarks.bounding_box()
+        return box if box[2] > 0 and box[3] > 0 else None
+    return ImageContext.of(image).face_box
+
+def _normalized_face(image, roi):
+    """Grayscale face region resized to LIVENESS_TEXTURE_SIZE (whole image if roi is None)"""
+    if roi is not None:
+        x, y, w, h = roi
+        image = image[y:y+h, x:x+w]
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if len(image.shape) == 3 else image
+    return cv2.resize(gray, (LIVENESS_TEXTURE_SIZE, LIVENESS_TEXTURE_SIZE), interpolation=cv2.INTER_AREA)
+
+def detect_texture(image, roi=None):
+    """
+    Detect texture patterns to distinguish real face from photo
+    
+    With roi=(x, y, w, h) only the face region is analysed, resized to
+    LIVENESS_TEXTURE_SIZE so the score does not depend on camera resolution.
+    """
+    # Laplacian variance (measure of image sharpness/blur)
+    # Real faces typically have more texture variation
+    # Photos of faces tend to be flatter/blurrier
+    face = _normalized_face(image, roi)
+    return float(cv2.Laplacian(face, cv2.CV_32F).var())
+
+def detect_face_depth(image, landmarks=None):
+    """
+    Estimate depth using face size and position
+    
+    landmarks may be a FaceLandmarks already computed for image.
+    """
+    if landmarks is None:
+        landmarks = detect_landmarks(image)
+    if landmarks is None:
+        return 0.0
+    
+    # Calculate z-depth difference between nose tip and forehead (rough 3D estimate)
+    depth_diff = abs(landmarks.depth(NOSE_INDEX) - landmarks.depth(FOREHEAD_INDEX))
     
     return depth_diff
 
-def check_liveness(image, enable_blink=True, enable_texture=True, enable_depth=True):
+def check_liveness(image, enable_blink=True, enable_texture=True, enable_depth=True, return_details=False):
     """
     Multi-factor liveness detection
     Checks for: blink detection, texture analysis, and depth estimation
-    """
-    # Convert Streamlit UploadedFile to numpy array
-    if hasattr(image, 'read'):
-        from PIL import Image
-        pil_image = Image.open(image)
-        image = np.array(pil_image)
-        if len(image.shape) == 3 and image.shape[2] == 3:
-            image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
     
-    if isinstance(image, bytes):
-        nparr = np.frombuffer(image, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    Face Mesh runs once per image and its landmarks feed both the blink and
+    depth checks.
+    
+    image may be an ImageContext shared with verify_face, so decoding,
+    landmarks and the face box are computed once per request.
+    
+    Returns:
+        is_live, or (is_live, details) with return_details=True; details
+        holds each enabled check's result, 'timings_ms' (time of each
+        stage), 'overall_score' and 'is_live'
+    """
+    context = ImageContext.of(image)
+    image = context.bgr
     
     liveness_score = 0
     max_score = 0
     details = {}
+    timings = {}
+    
+    # Landmark stage, shared by every landmark-based check
+    landmarks = None
+    if enable_blink or enable_depth:
+        start = time.perf_counter()
+        landmarks = context.landmarks
+        timings['landmarks'] = (time.perf_counter() - start) * 1000
     
     # 1. Blink Detection (optional - works better with video)
     if enable_blink:
         max_score += 1
-        is_closed, ear_value = detect_blink(image)
+        start = time.perf_counter()
+        is_closed, ear_value = detect_blink(image, landmarks=landmarks) if landmarks is not None \
+            else (None, "No face detected")
+        timings['blink'] = (time.perf_counter() - start) * 1000
         if is_closed is not None:
             details['blink'] = {
                 'detected': True,
@@ -151,20 +339,25 @@ def check_liveness(image, enable_blink=True, enable_texture=True, enable_depth=T
     # 2. Texture Analysis
     if enable_texture:
         max_score += 1
-        texture_score = detect_texture(image)
-        details['texture'] = {'score': float(texture_score)}
+        start = time.perf_counter()
+        roi = face_region(context, landmarks)
+        texture_score = detect_texture(context.gray, roi)
+        timings['texture'] = (time.perf_counter() - start) * 1000
+        details['texture'] = {'score': texture_score, 'face_region': roi is not None}
         
-        # Real faces typically have Laplacian variance > 100
-        # Photos tend to be < 50
-        if texture_score > 100:
+        # Real faces typically score > LIVENESS_TEXTURE_THRESHOLD on the
+        # normalized face region; recaptured photos tend to be below half of it
+        if texture_score > LIVENESS_TEXTURE_THRESHOLD:
             liveness_score += 1
-        elif texture_score > 50:
+        elif texture_score > LIVENESS_TEXTURE_THRESHOLD / 2:
             liveness_score += 0.5
     
     # 3. Depth Estimation
     if enable_depth:
         max_score += 1
-        depth_score = detect_face_depth(image)
+        start = time.perf_counter()
+        depth_score = detect_face_depth(image, landmarks=landmarks) if landmarks is not None else 0.0
+        timings['depth'] = (time.perf_counter() - start) * 1000
         details['depth'] = {'score': float(depth_score)}
         
         # Real 3D faces have depth variation > 0.01
@@ -180,10 +373,11 @@ def check_liveness(image, enable_blink=True, enable_texture=True, enable_depth=T
     else:
         liveness_probability = 0.0
     
+    details['timings_ms'] = timings
     details['overall_score'] = float(liveness_probability)
     details['is_live'] = liveness_probability >= 0.6
     
     print(f"Liveness detection: {liveness_probability:.2f} - {'LIVE' if details['is_live'] else 'SPOOFED'}")
     print(f"Details: {details}")
     
-    return details['is_live']
\ No newline at end of file
+    return (details['is_live'], details) if return_details else details['is_live']
\ No newline at end of file
@@ -0,0 +1,367 @@
+import time
+import cv2
+import numpy as np
+
+# Array-backed minutiae: one packed 9-byte record per minutia
+MINUTIAE_DTYPE = np.dtype([
+    ('x', '<i2'),
+    ('y', '<i2'),
+    ('type', 'u1'),
+    ('angle', '<f4')
+])
+
+# Minutia type codes are the crossing numbers that produced them
+MINUTIA_TYPES = {'ending': 1, 'bifurcation': 3}
+MINUTIA_TYPE_NAMES = {code: name for name, code in MINUTIA_TYPES.items()}
+
+# Grid keys pack (cell_x, cell_y) into one int64
+_KEY_SHIFT = 1 << 20
+_KEY_OFFSET = 1 << 19
+
+def as_minutiae_array(minutiae):
+    """
+    Convert minutiae to a MINUTIAE_DTYPE structured array
+
+    Accepts the legacy list of {'position', 'type', 'orientation'} dicts or
+    an array that already has the right dtype (returned unchanged).
+    """
+    if isinstance(minutiae, np.ndarray) and minutiae.dtype == MINUTIAE_DTYPE:
+        return minutiae
+
+    records = np.empty(len(minutiae), dtype=MINUTIAE_DTYPE)
+    for k, m in enumerate(minutiae):
+        records[k] = (m['position'][0], m['position'][1],
+                      MINUTIA_TYPES[m['type']], m['orientation'])
+    return records
+
+def expand_ranges(left, right):
+    """
+    Every index covered by the [left, right) ranges, without a Python loop
+
+    Returns:
+        (range_idx, position) arrays: position runs through each range in
+        order and range_idx is the range it belongs to
+    """
+    counts = right - left
+    total = int(counts.sum())
+    range_idx = np.repeat(np.arange(len(left)), counts)
+    within = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    return range_idx, np.repeat(left, counts) + within
+
+def spread_subset(minutiae, limit):
+    """Evenly spaced subset of at most limit minutiae (deterministic)"""
+    if len(minutiae) <= limit:
+        return minutiae
+    return minutiae[np.linspace(0, len(minutiae) - 1, limit).astype(np.int64)]
+
+def _cell_keys(cx, cy):
+    """Pack integer cell coordinates into sortable int64 keys"""
+    return (cx.astype(np.int64) + _KEY_OFFSET) * _KEY_SHIFT + (cy.astype(np.int64) + _KEY_OFFSET)
+
+class GridIndex:
+    """
+    Uniform grid over minutia positions
+
+    Points are bucketed into square cells of cell_size pixels and kept sorted
+    by cell key, so every point within cell_size of a query lies in the 3x3
+    block of cells around it and can be found with searchsorted.
+    """
+    __slots__ = ('cell_size', 'xy', 'order', 'sorted_keys')
+
+    def __init__(self, xy, cell_size):
+        self.cell_size = float(cell_size)
+        self.xy = np.asarray(xy, dtype=np.float32).reshape(-1, 2)
+
+        cells = np.floor(self.xy / self.cell_size).astype(np.int64)
+        keys = _cell_keys(cells[:, 0], cells[:, 1])
+        self.order = np.argsort(keys, kind='stable')
+        self.sorted_keys = keys[self.order]
+
+    @classmethod
+    def from_sorted(cls, xy, cell_size, order, sorted_keys):
+        """Rebuild an index from a saved sort order and keys (no sorting)"""
+        index = cls.__new__(cls)
+        index.cell_size = float(cell_size)
+        index.xy = np.asarray(xy, dtype=np.float32).reshape(-1, 2)
+        index.order = order
+        index.sorted_keys = sorted_keys
+        return index
+
+    @property
+    def nbytes(self):
+        return self.xy.nbytes + self.order.nbytes + self.sorted_keys.nbytes
+
+    def query_pairs(self, probe_xy, radius):
+        """
+        Find all (probe, indexed) point pairs closer than radius
+
+        radius must not exceed cell_size.
+
+        Returns:
+            (probe_idx, indexed_idx, distance) arrays
+        """
+        probe_xy = np.asarray(probe_xy, dtype=np.float32).reshape(-1, 2)
+        cells = np.floor(probe_xy / self.cell_size).astype(np.int64)
+
+        probe_parts, indexed_parts = [], []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                keys = _cell_keys(cells[:, 0] + dx, cells[:, 1] + dy)
+                left = np.searchsorted(self.sorted_keys, keys, side='left')
+                right = np.searchsorted(self.sorted_keys, keys, side='right')
+                probe_idx, positions = expand_ranges(left, right)
+                if len(positions) == 0:
+                    continue
+                probe_parts.append(probe_idx)
+                indexed_parts.append(self.order[positions])
+
+        if not probe_parts:
+            empty = np.empty(0, np.int64)
+            return empty, empty, np.empty(0, np.float32)
+
+        probe_idx = np.concatenate(probe_parts)
+        indexed_idx = np.concatenate(indexed_parts)
+        distance = np.linalg.norm(probe_xy[probe_idx] - self.xy[indexed_idx], axis=1)
+
+        keep = distance <= radius
+        return probe_idx[keep], indexed_idx[keep], distance[keep]
+
+def angle_difference(a, b):
+    """Absolute angular difference wrapped to [0, pi]"""
+    return np.abs((a - b + np.pi) % (2 * np.pi) - np.pi)
+
+def one_to_one_assignment(rows, cols, cost):
+    """
+    Greedy one-to-one assignment of candidate pairs by increasing cost
+
+    Runs in rounds: every pair that is the cheapest option of both of its
+    endpoints is accepted, then all pairs touching a matched endpoint are
+    dropped. This is equivalent to the sequential greedy matching, but each
+    round is a handful of vectorized operations.
+
+    Returns:
+        boolean mask over the candidate pairs selecting the assignment
+    """
+    n = len(cost)
+    selected = np.zeros(n, dtype=bool)
+    if n == 0:
+        return selected
+
+    # Unique total order over candidates (ties broken by index)
+    rank = np.empty(n, np.int64)
+    rank[np.lexsort((cols, rows, cost))] = np.arange(n)
+
+    active = np.arange(n)
+    while len(active):
+        r, c, k = rows[active], cols[active], rank[active]
+
+        best_row = np.full(rows.max() + 1, n, np.int64)
+        best_col = np.full(cols.max() + 1, n, np.int64)
+        np.minimum.at(best_row, r, k)
+        np.minimum.at(best_col, c, k)
+
+        mutual = (best_row[r] == k) & (best_col[c] == k)
+        selected[active[mutual]] = True
+
+        used_rows = np.zeros(rows.max() + 1, dtype=bool)
+        used_cols = np.zeros(cols.max() + 1, dtype=bool)
+        used_rows[r[mutual]] = True
+        used_cols[c[mutual]] = True
+        active = active[~(used_rows[r] | used_cols[c])]
+
+    return selected
+
+def find_minutiae_pairs(stored, probe, tolerance_distance=20, tolerance_angle=np.pi / 6, index=None):
+    """
+    One-to-one corresponding minutiae between two structured arrays
+
+    Candidates come from a grid index over the stored minutiae, are filtered
+    by type and angle in bulk, and are then assigned one-to-one by distance.
+
+    Returns:
+        (stored_idx, probe_idx) arrays of matched pairs
+    """
+    if index is None:
+        stored_xy = np.column_stack((stored['x'], stored['y']))
+        index = GridIndex(stored_xy, tolerance_distance)
+
+    probe_xy = np.column_stack((probe['x'], probe['y']))
+    probe_idx, stored_idx, distance = index.query_pairs(probe_xy, tolerance_distance)
+
+    compatible = stored['type'][stored_idx] == probe['type'][probe_idx]
+    compatible &= angle_difference(stored['angle'][stored_idx], probe['angle'][probe_idx]) < tolerance_angle
+
+    stored_idx, probe_idx, distance = stored_idx[compatible], probe_idx[compatible], distance[compatible]
+    selected = one_to_one_assignment(stored_idx, probe_idx, distance)
+
+    return stored_idx[selected], probe_idx[selected]
+
+def match_minutiae_arrays(stored, probe, tolerance_distance=20, tolerance_angle=np.pi / 6):
+    """Fraction of one-to-one matched minutiae between two structured arrays"""
+    if len(stored) == 0 or len(probe) == 0:
+        return 0.0
+
+    stored_idx, _ = find_minutiae_pairs(stored, probe, tolerance_distance, tolerance_angle)
+    return len(stored_idx) / max(len(stored), len(probe))
+
+def transform_minutiae(minutiae, dx, dy, dtheta):
+    """Rotate minutiae by dtheta about the origin, then shift by (dx, dy)"""
+    cos_t, sin_t = np.cos(dtheta), np.sin(dtheta)
+    x = minutiae['x'].astype(np.float64)
+    y = minutiae['y'].astype(np.float64)
+
+    moved = minutiae.copy()
+    limits = np.iinfo(np.int16)
+    moved['x'] = np.clip(np.rint(cos_t * x - sin_t * y + dx), limits.min, limits.max)
+    moved['y'] = np.clip(np.rint(sin_t * x + cos_t * y + dy), limits.min, limits.max)
+    moved['angle'] = (minutiae['angle'] + dtheta + np.pi) % (2 * np.pi) - np.pi
+    return moved
+
+def hough_alignment(stored, probe, angle_bin=np.deg2rad(10), translation_bin=10,
+                    max_hypotheses=3, max_minutiae=512, chunk_pairs=1 << 20):
+    """
+    Estimate rigid transforms mapping probe minutiae onto stored minutiae
+
+    Every type-compatible (stored, probe) pair votes for the rotation that
+    aligns their angles and the translation that then maps one position onto
+    the other. Votes go into a NumPy (dtheta, dx, dy) accumulator, processed
+    in chunks of at most chunk_pairs pairs, which is smoothed over
+    neighbouring bins before the strongest local peaks are picked. Very dense
+    (noisy) templates vote with an evenly spread subset of max_minutiae
+    points per side, which bounds the cost without moving the peak.
+
+    Returns:
+        list of up to max_hypotheses dicts with 'dx', 'dy', 'dtheta' and
+        'votes', strongest first
+    """
+    if len(stored) == 0 or len(probe) == 0:
+        return []
+    stored = spread_subset(stored, max_minutiae)
+    probe = spread_subset(probe, max_minutiae)
+
+    # Rotate about the probe centroid to keep the translation range small
+    s_xy = np.column_stack((stored['x'], stored['y'])).astype(np.float32)
+    p_xy = np.column_stack((probe['x'], probe['y'])).astype(np.float32)
+    center = p_xy.mean(axis=0)
+    q_xy = p_xy - center
+    reach = float(np.linalg.norm(q_xy, axis=1).max())
+
+    origin = s_xy.min(axis=0) - reach
+    n_angle = int(round(2 * np.pi / angle_bin))
+    n_x = int(np.ceil((s_xy[:, 0].max() + reach - origin[0]) / translation_bin)) + 1
+    n_y = int(np.ceil((s_xy[:, 1].max() + reach - origin[1]) / translation_bin)) + 1
+    votes = np.zeros(n_angle * n_x * n_y, np.int64)
+
+    # Per-minutia trig; per-pair rotations follow from the angle-difference identities
+    s_angle = stored['angle'].astype(np.float32)
+    p_angle = probe['angle'].astype(np.float32)
+    s_cos, s_sin = np.cos(s_angle), np.sin(s_angle)
+    p_cos, p_sin = np.cos(p_angle), np.sin(p_angle)
+
+    # Dense (stored block x probe) grids, one type at a time (only same-type pairs vote)
+    for code in np.intersect1d(stored['type'], probe['type']):
+        s_sel = np.flatnonzero(stored['type'] == code)
+        p_sel = np.flatnonzero(probe['type'] == code)
+        pc, ps, pa = p_cos[p_sel], p_sin[p_sel], p_angle[p_sel]
+        qx, qy = q_xy[p_sel, 0], q_xy[p_sel, 1]
+
+        rows_per_chunk = max(1, chunk_pairs // len(p_sel))
+        for start in range(0, len(s_sel), rows_per_chunk):
+            block = s_sel[start:start + rows_per_chunk]
+
+            cos_t = s_cos[block, None] * pc + s_sin[block, None] * ps
+            sin_t = s_sin[block, None] * pc - s_cos[block, None] * ps
+            x_bin = ((s_xy[block, 0, None] - origin[0] - (cos_t * qx - sin_t * qy))
+                     / translation_bin).astype(np.int32)
+            y_bin = ((s_xy[block, 1, None] - origin[1] - (sin_t * qx + cos_t * qy))
+                     / translation_bin).astype(np.int32)
+
+            dtheta = (s_angle[block, None] - pa) % np.float32(2 * np.pi)
+            a_bin = np.minimum((dtheta / angle_bin).astype(np.int32), n_angle - 1)
+
+            flat = (a_bin * n_x + x_bin) * n_y + y_bin
+            votes += np.bincount(flat.ravel(), minlength=votes.size)
+
+    # 3x3x3 smoothing (angle axis wraps around) and local-maximum peaks
+    acc = votes.reshape(n_angle, n_x, n_y).astype(np.float32)
+    smoothed = np.stack([cv2.boxFilter(plane, -1, (3, 3), normalize=False,
+                                       borderType=cv2.BORDER_CONSTANT) for plane in acc])
+    smoothed = smoothed + np.roll(smoothed, 1, axis=0) + np.roll(smoothed, -1, axis=0)
+    dilated = np.stack([cv2.dilate(plane, np.ones((3, 3), np.uint8)) for plane in smoothed])
+    dilated = np.maximum(dilated, np.maximum(np.roll(dilated, 1, axis=0), np.roll(dilated, -1, axis=0)))
+
+    peaks = np.flatnonzero((smoothed == dilated) & (smoothed > 0))
+    peaks = peaks[np.argsort(-smoothed.ravel()[peaks], kind='stable')[:max_hypotheses]]
+
+    hypotheses = []
+    steps = np.array([-1, 0, 1])
+    for peak in peaks:
+        a, x, y = np.unravel_index(peak, smoothed.shape)
+
+        # Sub-bin refinement: vote-weighted mean offset around the peak
+        xs, ys = x + steps, y + steps
+        weights = acc[np.ix_((a + steps) % n_angle, np.clip(xs, 0, n_x - 1), np.clip(ys, 0, n_y - 1))]
+        weights = weights * ((xs >= 0) & (xs < n_x))[None, :, None] * ((ys >= 0) & (ys < n_y))[None, None, :]
+        total = weights.sum()
+        a_f = a + weights.sum(axis=(1, 2)) @ steps / total
+        x_f = x + weights.sum(axis=(0, 2)) @ steps / total
+        y_f = y + weights.sum(axis=(0, 1)) @ steps / total
+
+        dtheta = (a_f + 0.5) * angle_bin
+        offset = origin + (np.array([x_f, y_f]) + 0.5) * translation_bin
+        cos_t, sin_t = np.cos(dtheta), np.sin(dtheta)
+
+        # p' = R (p - c) + offset  ==  R p + (offset - R c)
+        hypotheses.append({
+            'dx': float(offset[0] - (cos_t * center[0] - sin_t * center[1])),
+            'dy': float(offset[1] - (sin_t * center[0] + cos_t * center[1])),
+            'dtheta': float((dtheta + np.pi) % (2 * np.pi) - np.pi),
+            'votes': int(votes[peak])
+        })
+
+    return hypotheses
+
+def align_and_match(stored, probe, threshold=None, tolerance_distance=20,
+                    tolerance_angle=np.pi / 6, max_hypotheses=3, index=None):
+    """
+    Align the probe to the stored minutiae, then score the match
+
+    Hypotheses from hough_alignment are scored strongest first, followed by
+    the identity transform. If threshold is given, scoring stops at the first
+    hypothesis that reaches it; every further hypothesis counts as a retry.
+    A GridIndex over the stored minutiae saved at enrollment can be passed
+    as index (it is rebuilt if its cell size differs from tolerance_distance).
+
+    Returns:
+        dict with 'score', 'matched', the chosen 'transform', the number of
+        'hypotheses' scored and 'retries', plus 'alignment_ms' / 'scoring_ms'
+    """
+    details = {
+        'score': 0.0, 'matched': 0, 'transform': None,
+        'hypotheses': 0, 'retries': 0, 'alignment_ms': 0.0, 'scoring_ms': 0.0
+    }
+    if len(stored) == 0 or len(probe) == 0:
+        return details
+
+    start = time.perf_counter()
+    candidates = hough_alignment(stored, probe, max_hypotheses=max_hypotheses)
+    candidates.append({'dx': 0.0, 'dy': 0.0, 'dtheta': 0.0, 'votes': 0})
+    details['alignment_ms'] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    if index is None or index.cell_size != tolerance_distance:
+        index = GridIndex(np.column_stack((stored['x'], stored['y'])), tolerance_distance)
+    for transform in candidates:
+        moved = transform_minutiae(probe, transform['dx'], transform['dy'], transform['dtheta'])
+        matched, _ = find_minutiae_pairs(stored, moved, tolerance_distance, tolerance_angle, index=index)
+        score = len(matched) / max(len(stored), len(probe))
+        details['hypotheses'] += 1
+
+        if details['transform'] is None or score > details['score']:
+            details.update(score=score, matched=len(matched), transform=transform)
+        if threshold is not None and score >= threshold:
+            break
+    details['scoring_ms'] = (time.perf_counter() - start) * 1000
+    details['retries'] = details['hypotheses'] - 1
+
+    return details
@@ -0,0 +1,147 @@
+import numpy as np
+from modules.minutiae_matching import GridIndex, angle_difference
+from modules.settings import FINGERPRINT_PRUNE_DISTANCE
+
+# Skeletons the pruning rules hold for: the morphological skeleton is not
+# one pixel wide, so nearly every candidate on it looks like a spur or cluster
+PRUNABLE_THINNING_METHODS = ('zhang_suen', 'guo_hall')
+
+# 8-neighbour offsets as (row, col)
+_OFFSETS = np.array([(-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1)])
+
+def trace_ridges(skel, crossing, rows, cols, max_steps):
+    """
+    Follow the skeleton from several start pixels at once
+
+    All traces advance one pixel per step (never back onto the previous
+    two pixels, preferring the neighbour farthest from where they came
+    from) and stop at the first ridge ending or bifurcation they reach.
+
+    Returns:
+        (kind, end_rows, end_cols, steps): kind is the crossing number where
+        a trace stopped (1 or 3), or 0 if it ran max_steps pixels or died out
+    """
+    ridge = skel == 255
+    h, w = ridge.shape
+    n = len(rows)
+    cur = np.column_stack((rows, cols)).astype(np.int64)
+    prev, prev2 = cur.copy(), cur.copy()
+    kind = np.zeros(n, np.uint8)
+    end = cur.copy()
+    steps = np.zeros(n, np.int64)
+    active = np.ones(n, dtype=bool)
+
+    for step in range(1, max_steps + 1):
+        idx = np.flatnonzero(active)
+        if len(idx) == 0:
+            break
+
+        neighbours = cur[idx, None, :] + _OFFSETS[None, :, :]
+        inside = ((neighbours[..., 0] >= 0) & (neighbours[..., 0] < h) &
+                  (neighbours[..., 1] >= 0) & (neighbours[..., 1] < w))
+        r = np.clip(neighbours[..., 0], 0, h - 1)
+        c = np.clip(neighbours[..., 1], 0, w - 1)
+        valid = inside & ridge[r, c]
+        valid &= ~np.all(neighbours == prev[idx, None, :], axis=2)
+        valid &= ~np.all(neighbours == prev2[idx, None, :], axis=2)
+
+        # Dead ends stop; the rest move to the neighbour farthest from prev
+        moving = valid.any(axis=1)
+        active[idx[~moving]] = False
+        idx, neighbours, valid = idx[moving], neighbours[moving], valid[moving]
+        spread = np.where(valid, ((neighbours - prev[idx, None, :]) ** 2).sum(axis=2), -1)
+        nxt = neighbours[np.arange(len(idx)), np.argmax(spread, axis=1)]
+
+        prev2[idx], prev[idx], cur[idx] = prev[idx], cur[idx], nxt
+
+        cn = crossing[nxt[:, 0], nxt[:, 1]]
+        stop = (cn == 1) | (cn == 3)
+        kind[idx[stop]] = cn[stop]
+        end[idx[stop]] = nxt[stop]
+        steps[idx[stop]] = step
+        active[idx[stop]] = False
+
+    return kind, end[:, 0], end[:, 1], steps
+
+def _axial_difference(a, b):
+    """Difference between two undirected orientations, in [0, pi/2]"""
+    difference = angle_difference(a, b)
+    return np.minimum(difference, np.pi - difference)
+
+def _close_pairs(rows, cols, candidates, radius):
+    """(i, j) index pairs (i < j) among candidates closer than radius"""
+    xy = np.column_stack((cols[candidates], rows[candidates]))
+    if len(xy) < 2:
+        empty = np.empty(0, np.int64)
+        return empty, empty
+    a, b, _ = GridIndex(xy, radius).query_pairs(xy, radius)
+    keep = a < b
+    return candidates[a[keep]], candidates[b[keep]]
+
+def prune_minutiae(skel, crossing, rows, cols, types, angles, max_distance=FINGERPRINT_PRUNE_DISTANCE):
+    """
+    Remove skeleton artifacts from detected minutiae
+
+    Rules, applied in order:
+      * spur: an ending whose ridge reaches a bifurcation within
+        max_distance pixels (both removed)
+      * short ridge / island: an ending whose ridge reaches another ending
+        within max_distance pixels (both removed)
+      * broken ridge: two endings closer than 2 x max_distance with the same
+        orientation, facing each other along the ridge (both removed)
+      * bridge: two bifurcations closer than max_distance (both removed)
+      * cluster: any minutia with two or more others within max_distance
+
+    Args:
+        skel: skeleton the minutiae were detected on (ridge pixels = 255)
+        crossing: crossing_number_map(skel)
+        rows, cols, types, angles: the detected minutiae
+
+    Returns:
+        boolean mask over the minutiae selecting those to keep
+    """
+    n = len(rows)
+    keep = np.ones(n, dtype=bool)
+    if n == 0:
+        return keep
+
+    # Position -> minutia lookup for trace end points
+    w = skel.shape[1]
+    flat = rows.astype(np.int64) * w + cols
+    order = np.argsort(flat)
+
+    def lookup(end_rows, end_cols):
+        target = end_rows.astype(np.int64) * w + end_cols
+        pos = np.minimum(np.searchsorted(flat[order], target), n - 1)
+        found = flat[order][pos] == target
+        return order[pos[found]], found
+
+    # Spurs and short ridges, by ridge tracing from every ending
+    endings = np.flatnonzero(types == 1)
+    kind, end_rows, end_cols, _ = trace_ridges(skel, crossing, rows[endings], cols[endings], max_distance)
+    artifact = kind > 0
+    keep[endings[artifact]] = False
+    partners, _ = lookup(end_rows[artifact], end_cols[artifact])
+    keep[partners] = False
+
+    # Broken ridges: endings with the same orientation facing each other
+    # along the ridge (angles are gradient directions, across the ridge)
+    a, b = _close_pairs(rows, cols, np.flatnonzero(keep & (types == 1)), 2 * max_distance)
+    aligned = _axial_difference(angles[a], angles[b]) < np.pi / 6
+    gap = np.arctan2(rows[b] - rows[a], cols[b] - cols[a])
+    aligned &= _axial_difference(gap, angles[a] + np.pi / 2) < np.pi / 4
+    keep[a[aligned]] = False
+    keep[b[aligned]] = False
+
+    # Bridges between neighbouring ridges
+    a, b = _close_pairs(rows, cols, np.flatnonzero(keep & (types == 3)), max_distance)
+    keep[a] = False
+    keep[b] = False
+
+    # Clusters of whatever is left
+    survivors = np.flatnonzero(keep)
+    a, b = _close_pairs(rows, cols, survivors, max_distance)
+    neighbours = np.bincount(np.concatenate((a, b)), minlength=n)
+    keep[neighbours >= 2] = False
+
+    return keep
@@ -9,23 +9,63 @@ FACE_THRESHOLD = 0.6  # Cosine similarity threshold (0.0 to 1.0)
 FINGERPRINT_THRESHOLD = 0.3  # Minutiae match score threshold (0.0 to 1.0)
 # Higher = more strict, Lower = more lenient
 # Recommended: 0.2-0.4 for fingerprint matching
+# On synthetic prints (+/-15 deg, +/-20 px between impressions) 0.3 is the
+# lowest impostor-free threshold of guo_hall with pruning (the default) and
+# the equal-error point of the legacy morphological pipeline
+
+# Fingerprint Processing
+FINGERPRINT_THINNING_METHOD = "guo_hall"  # "morphological", "zhang_suen" or "guo_hall"
+# Used for new enrollments; templates keep the settings they were extracted
+# with (older ones were enrolled with the morphological skeleton)
+FINGERPRINT_ENHANCEMENT = "adaptive"  # "adaptive" (threshold) or "gabor" (oriented filter bank)
+FINGERPRINT_SEGMENTATION = True  # Crop to the ridge region before enhancement
+FINGERPRINT_SEGMENTATION_BLOCK = 16  # Block size (pixels) for the variance foreground mask
+FINGERPRINT_SEGMENTATION_THRESHOLD = 0.1  # Foreground if block variance > this x image variance
+FINGERPRINT_PRUNING = True  # Remove spurs, bridges, broken ridges and clusters (zhang_suen/guo_hall skeletons only)
+FINGERPRINT_PRUNE_DISTANCE = 10  # Pixels: max spur/bridge length and cluster radius
+FINGERPRINT_ALIGNMENT_HYPOTHESES = 3  # Hough alignment peaks tried before giving up
+# Comparison cascade: reject before full matching when global descriptors disagree
+FINGERPRINT_CASCADE_COUNT_RATIO = 0.25  # Reject if min/max minutiae count is below this
+FINGERPRINT_CASCADE_TYPE_DIFFERENCE = 0.4  # Reject if ridge-ending fractions differ by more
+FINGERPRINT_CASCADE_ORIENTATION_DISTANCE = 0.6  # Reject if angle histograms differ by more (0-1)
 
 # Database Configuration
 DATABASE_PATH = "database/users.db"
+TEMPLATE_CACHE_MAX_BYTES = 64 * 1024 * 1024  # Memory budget for cached templates
+FACE_GALLERY_PATH = "database/face_gallery"  # Memory-mapped embedding matrix (.npy + .json)
+FACE_EMBEDDING_DTYPE = "float32"  # Face template storage: "float32", "float16" or "int8"
+FACE_ANN_PATH = "database/face_ivf.npz"  # IVF index over the face gallery
+FACE_ANN_NPROBE = 8  # IVF cells scanned per probe (higher = better recall, slower)
+FACE_ANN_MIN_USERS = 2000  # Below this gallery size identification scans every user
+FINGERPRINT_INDEX_PATH = "database/fingerprint_index.npz"  # Geometric-hashing index of minutia pairs
+FINGERPRINT_INDEX_CANDIDATES = 10  # Candidates passed to the full matcher during identification
 
 # Liveness Detection Settings
-LIVENESS_TEXTURE_THRESHOLD = 100  # Laplacian variance threshold
+LIVENESS_TEXTURE_THRESHOLD = 150  # Laplacian variance threshold of the face region at LIVENESS_TEXTURE_SIZE
+LIVENESS_TEXTURE_SIZE = 128  # Face region is resized to this square before texture analysis
 LIVENESS_DEPTH_THRESHOLD = 0.015  # 3D depth threshold
 LIVENESS_OVERALL_THRESHOLD = 0.6  # Overall liveness score threshold
+LIVENESS_BLINK_EAR_THRESHOLD = 0.2  # Eye aspect ratio below which the eyes count as closed
+LIVENESS_BLINK_MIN_FRAMES = 1  # Consecutive closed frames that make up a blink
+LIVENESS_BLINK_MAX_FRAMES = 10  # Longer closures are not counted as blinks
+LIVENESS_VIDEO_REQUIRED_BLINKS = 1  # Blinks needed before a video is declared live
+LIVENESS_VIDEO_MAX_FRAMES = 150  # Frames consumed before giving up (about 5 s at 30 fps)
 
 # Security Settings
 PASSWORD_HASH_ALGORITHM = "md5"  # NOTE: Use bcrypt or argon2 in production!
 SESSION_TIMEOUT = 3600  # seconds (1 hour)
+AUTH_PARALLEL_FACTORS = True  # Verify face and fingerprint concurrently
+AUTH_MAX_WORKERS = 4  # Threads shared by all concurrent factor evaluations
+AUTH_EARLY_TERMINATION = True  # Skip remaining factors once the decision cannot change
+# Initial expected cost per factor (ms); factors run cheapest first, refined from observed timings
+AUTH_FACTOR_COST_MS = {'password': 1, 'face': 150, 'fingerprint': 500}
 
 # Image Processing Settings
 MAX_IMAGE_SIZE = 5000  # Maximum image dimension in pixels
 MIN_IMAGE_SIZE = 50    # Minimum image dimension in pixels
 FACE_DETECTION_SCALE = 800  # Resize large images for faster face detection
+FACE_DETECTION_MIN_FRACTION = 0.1  # Smallest face searched, as a fraction of the frame's shorter side
+FACE_DETECTION_MAX_FRACTION = 1.0  # Largest face searched, as a fraction of the frame's shorter side
 
 # Enrollment Settings
 MIN_FACE_QUALITY = 0.5  # Minimum quality score for face enrollment
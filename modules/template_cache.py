@@ -0,0 +1,103 @@
+import sys
+import threading
+from collections import OrderedDict
+import numpy as np
+from modules.settings import TEMPLATE_CACHE_MAX_BYTES
+
+class TemplateCache:
+    """
+    Bounded LRU cache for loaded biometric templates
+
+    Entries are keyed by (modality, user_id) and remember the stamp they were
+    loaded under (the template store's per-row version). A lookup with a
+    different stamp reloads only that entry, so a template rewritten by
+    another process is picked up without touching anyone else's;
+    in-process enrollment invalidates explicitly.
+    Cached arrays are made read-only because they are shared between callers.
+    """
+
+    def __init__(self, max_bytes=TEMPLATE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (value, stamp, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _sizeof(value):
+        if isinstance(value, np.ndarray) or hasattr(value, 'nbytes'):
+            return value.nbytes
+        return sys.getsizeof(value)
+
+    def get(self, key, loader, stamp=None):
+        """
+        Return the cached value for key, calling loader() on a miss
+
+        None results are not cached (the user may enroll later).
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] == stamp:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                self._remove(key)
+                self.invalidations += 1
+            self.misses += 1
+
+        value = loader()
+        if value is None:
+            return None
+        return self.put(key, value, stamp)
+
+    def put(self, key, value, stamp=None):
+        """Cache value for key under stamp (replacing any entry) and return it"""
+        if isinstance(value, np.ndarray):
+            value.flags.writeable = False
+        size = self._sizeof(value)
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size <= self.max_bytes:
+                self._entries[key] = (value, stamp, size)
+                self._bytes += size
+                while self._bytes > self.max_bytes:
+                    self._remove(next(iter(self._entries)))
+                    self.evictions += 1
+        return value
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def invalidate(self, key=None):
+        """Drop one entry (or everything when key is None)"""
+        with self._lock:
+            if key is None:
+                self.invalidations += len(self._entries)
+                self._entries.clear()
+                self._bytes = 0
+            elif key in self._entries:
+                self._remove(key)
+                self.invalidations += 1
+
+    def stats(self):
+        """Hit/miss/eviction counters and current memory use"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes
+            }
+
+# Shared by load_face_embedding and load_fingerprint_template
+template_cache = TemplateCache()
@@ -0,0 +1,233 @@
+import os
+import sys
+import glob
+import time
+import sqlite3
+import argparse
+import threading
+from modules.settings import DATABASE_PATH
+
+# Modalities stored in the templates table
+FACE = "face"
+FINGERPRINT = "fingerprint"
+FINGERPRINT_DESCRIPTOR = "fingerprint_descriptor"  # Global summary used by the comparison cascade
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS templates (
+    user_id    TEXT NOT NULL,
+    modality   TEXT NOT NULL,
+    data       BLOB NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (user_id, modality)
+)
+"""
+
+class TemplateStore:
+    """
+    Single SQLite file holding every enrolled biometric template
+
+    Templates are opaque blobs keyed by (user_id, modality); callers own the
+    serialization. The database runs in WAL mode so any number of readers
+    can load templates while an enrollment is being written, and every write
+    is a single transaction. Connections are kept per thread.
+    """
+
+    def __init__(self, path=DATABASE_PATH):
+        self.path = path
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._connection() as conn:
+            conn.execute(_SCHEMA)
+
+    def _connection(self):
+        """Per-thread connection (sqlite3 connections must not be shared)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def put(self, user_id, modality, data):
+        """Insert or replace one template atomically"""
+        self.put_many([(user_id, modality, data)])
+
+    def put_many(self, rows):
+        """Insert or replace several (user_id, modality, data) rows in one transaction"""
+        now = time.time()
+        with self._connection() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO templates (user_id, modality, data, updated_at) VALUES (?, ?, ?, ?)",
+                [(user_id, modality, sqlite3.Binary(data), now) for user_id, modality, data in rows]
+            )
+
+    def get(self, user_id, modality):
+        """Template blob for a user, or None if not enrolled"""
+        row = self._connection().execute(
+            "SELECT data FROM templates WHERE user_id = ? AND modality = ?", (user_id, modality)
+        ).fetchone()
+        return bytes(row[0]) if row else None
+
+    def load_all(self, modality):
+        """Bulk load: dict of user_id -> template blob for one modality"""
+        rows = self._connection().execute(
+            "SELECT user_id, data FROM templates WHERE modality = ? ORDER BY user_id", (modality,)
+        )
+        return {user_id: bytes(data) for user_id, data in rows}
+
+    def users(self, modality=None):
+        """Sorted list of enrolled user ids (optionally for one modality)"""
+        if modality is None:
+            rows = self._connection().execute("SELECT DISTINCT user_id FROM templates ORDER BY user_id")
+        else:
+            rows = self._connection().execute(
+                "SELECT user_id FROM templates WHERE modality = ? ORDER BY user_id", (modality,)
+            )
+        return [row[0] for row in rows]
+
+    def delete(self, user_id, modality=None):
+        """Remove a user's templates (all modalities by default)"""
+        with self._connection() as conn:
+            if modality is None:
+                conn.execute("DELETE FROM templates WHERE user_id = ?", (user_id,))
+            else:
+                conn.execute("DELETE FROM templates WHERE user_id = ? AND modality = ?", (user_id, modality))
+
+    def version(self, user_id, modality):
+        """
+        Change marker for one template: the updated_at of its row (None if
+        not enrolled). Reads no blob, so it is cheap enough to check on
+        every cache lookup.
+        """
+        row = self._connection().execute(
+            "SELECT updated_at FROM templates WHERE user_id = ? AND modality = ?", (user_id, modality)
+        ).fetchone()
+        return row[0] if row else None
+
+    def close(self):
+        """Close this thread's connection"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+def get_store():
+    """Process-wide TemplateStore at DATABASE_PATH"""
+    global _default_store
+    if _default_store is None:
+        with _default_store_lock:
+            if _default_store is None:
+                _default_store = TemplateStore(DATABASE_PATH)
+    return _default_store
+
+def migrate_pickle_directory(directory="database", store=None):
+    """
+    Import per-user template files into the template store
+
+    Reads face_<user>.pkl, fingerprint_<user>.pkl and fingerprint_<user>.fpt
+    (preferred over .pkl when both exist) and writes everything in a single
+    transaction. The source files are left untouched.
+
+    Returns:
+        dict with the number of imported templates per modality
+    """
+    from modules.face_recognition import read_legacy_embedding, serialize_face_embedding
+    from modules.fingerprint_template import read_legacy_template, read_template_file, serialize_template
+
+    store = store or get_store()
+
+    def user_of(path, prefix):
+        name = os.path.splitext(os.path.basename(path))[0]
+        return name[len(prefix):]
+
+    rows = []
+    for path in sorted(glob.glob(os.path.join(directory, "face_*.pkl"))):
+        rows.append((user_of(path, "face_"), FACE, serialize_face_embedding(read_legacy_embedding(path))))
+
+    fingerprints = {}
+    for path in sorted(glob.glob(os.path.join(directory, "fingerprint_*.pkl"))):
+        fingerprints[user_of(path, "fingerprint_")] = read_legacy_template(path)
+    for path in sorted(glob.glob(os.path.join(directory, "fingerprint_*.fpt"))):
+        fingerprints[user_of(path, "fingerprint_")] = read_template_file(path)
+    for user_id, minutiae in fingerprints.items():
+        rows.append((user_id, FINGERPRINT, serialize_template(minutiae)))
+
+    store.put_many(rows)
+
+    counts = {FACE: 0, FINGERPRINT: 0}
+    for _, modality, _ in rows:
+        counts[modality] += 1
+    return counts
+
+def template_statistics(store=None):
+    """
+    Summary of the enrolled templates
+
+    Returns:
+        dict with the number of face and fingerprint templates, their total
+        size in bytes, the mean / min / max fingerprint minutiae count and
+        'reenroll': users whose fingerprint template was extracted with
+        other settings than the current configuration
+    """
+    from modules.fingerprint_template import deserialize_prepared_template, LEGACY_EXTRACTION
+    from modules.fingerprint_recognition import current_extraction
+
+    store = store or get_store()
+    faces = store.load_all(FACE)
+    fingerprints = store.load_all(FINGERPRINT)
+    prepared = {user_id: deserialize_prepared_template(data) for user_id, data in fingerprints.items()}
+    counts = [len(template) for template in prepared.values()]
+
+    return {
+        'face_templates': len(faces),
+        'face_bytes': sum(len(data) for data in faces.values()),
+        'fingerprint_templates': len(fingerprints),
+        'fingerprint_bytes': sum(len(data) for data in fingerprints.values()),
+        'mean_minutiae': sum(counts) / len(counts) if counts else 0.0,
+        'min_minutiae': min(counts, default=0),
+        'max_minutiae': max(counts, default=0),
+        'reenroll': sorted(user_id for user_id, template in prepared.items()
+                           if (template.extraction or LEGACY_EXTRACTION) != current_extraction())
+    }
+
+def main(argv=None):
+    """Command line entry point: python -m modules.template_store migrate|stats"""
+    parser = argparse.ArgumentParser(description="Biometric template store maintenance")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    migrate = subparsers.add_parser("migrate", help="import per-user pickle templates")
+    migrate.add_argument("--source", default="database", help="directory with *.pkl / *.fpt templates")
+    migrate.add_argument("--db", default=DATABASE_PATH, help="SQLite template store to write")
+
+    stats = subparsers.add_parser("stats", help="summarize enrolled templates")
+    stats.add_argument("--db", default=DATABASE_PATH, help="SQLite template store to read")
+
+    args = parser.parse_args(argv)
+    if args.command == "migrate":
+        counts = migrate_pickle_directory(args.source, TemplateStore(args.db))
+        print(f"✅ Migrated {counts[FACE]} face and {counts[FINGERPRINT]} fingerprint templates into {args.db}")
+        if args.db == DATABASE_PATH:
+            from modules.face_index import rebuild_face_gallery
+            from modules.fingerprint_index import rebuild_fingerprint_index
+            rebuild_face_gallery()
+            rebuild_fingerprint_index()
+    elif args.command == "stats":
+        summary = template_statistics(TemplateStore(args.db))
+        print(f"Face templates:        {summary['face_templates']} ({summary['face_bytes']} bytes)")
+        print(f"Fingerprint templates: {summary['fingerprint_templates']} ({summary['fingerprint_bytes']} bytes)")
+        print(f"Minutiae per template: {summary['mean_minutiae']:.1f} average "
+              f"(min {summary['min_minutiae']}, max {summary['max_minutiae']})")
+        if summary['reenroll']:
+            print(f"To re-enroll (extracted with other settings): {', '.join(summary['reenroll'])}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
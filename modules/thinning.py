@@ -0,0 +1,186 @@
+import time
+import cv2
+import numpy as np
+
+# Available skeletonization algorithms (see skeletonize)
+THINNING_METHODS = ('morphological', 'zhang_suen', 'guo_hall')
+
+def skeletonize(binary, method="morphological", max_iterations=200):
+    """
+    Thin a binary ridge image (ridges = 255) down to a one-pixel skeleton
+
+    Args:
+        binary: uint8 image with ridge pixels set to 255
+        method: one of THINNING_METHODS
+        max_iterations: safety cap on thinning passes
+
+    Returns:
+        uint8 skeleton with ridge pixels set to 255
+    """
+    if method == "morphological":
+        return morphological_skeleton(binary, max_iterations)
+    if method == "zhang_suen":
+        return zhang_suen_thinning(binary, max_iterations)
+    if method == "guo_hall":
+        return guo_hall_thinning(binary, max_iterations)
+    raise ValueError(f"Unknown thinning method: {method} (expected one of {THINNING_METHODS})")
+
+def morphological_skeleton(binary, max_iterations=200):
+    """Morphological skeleton (union of erosion residues), reusing buffers"""
+    element = cv2.getStructuringElement(cv2.MORPH_CROSS, (3, 3))
+
+    skel = np.zeros(binary.shape, np.uint8)
+    temp = binary.copy()
+    eroded = np.empty_like(temp)
+    residue = np.empty_like(temp)
+
+    for _ in range(max_iterations):
+        cv2.erode(temp, element, dst=eroded)
+        cv2.morphologyEx(eroded, cv2.MORPH_OPEN, element, dst=residue)
+        cv2.subtract(eroded, residue, dst=residue)
+        cv2.bitwise_or(skel, residue, dst=skel)
+
+        # Swap buffers instead of copying the eroded image
+        temp, eroded = eroded, temp
+        if cv2.countNonZero(temp) == 0:
+            break
+
+    return skel
+
+def _padded_ridges(binary):
+    """0/1 copy of the ridge image with a one-pixel background border"""
+    padded = np.zeros((binary.shape[0] + 2, binary.shape[1] + 2), np.uint8)
+    padded[1:-1, 1:-1] = binary > 0
+    return padded
+
+def _neighbour_views(padded):
+    """Views of the 8 neighbours P2..P9 (clockwise from north) of every pixel"""
+    h, w = padded.shape[0] - 2, padded.shape[1] - 2
+    return (
+        padded[0:h, 1:w+1],      # P2 (N)
+        padded[0:h, 2:w+2],      # P3 (NE)
+        padded[1:h+1, 2:w+2],    # P4 (E)
+        padded[2:h+2, 2:w+2],    # P5 (SE)
+        padded[2:h+2, 1:w+1],    # P6 (S)
+        padded[2:h+2, 0:w],      # P7 (SW)
+        padded[1:h+1, 0:w],      # P8 (W)
+        padded[0:h, 0:w],        # P9 (NW)
+    )
+
+def zhang_suen_thinning(binary, max_iterations=200):
+    """
+    Vectorized Zhang-Suen thinning
+
+    Each sub-iteration evaluates the deletion rules for the whole image at
+    once. Neighbour views alias a single padded buffer, so deleting pixels in
+    place updates every view; thinning stops as soon as a pass removes nothing.
+    """
+    padded = _padded_ridges(binary)
+    center = padded[1:-1, 1:-1]
+    neighbours = _neighbour_views(padded)
+    p2, p3, p4, p5, p6, p7, p8, p9 = neighbours
+
+    count = np.empty(center.shape, np.uint8)
+    transitions = np.empty(center.shape, np.uint8)
+
+    for _ in range(max_iterations):
+        removed = 0
+        for step in (0, 1):
+            # B(P1): number of ridge neighbours
+            count.fill(0)
+            for p in neighbours:
+                count += p
+
+            # A(P1): number of 0 -> 1 transitions around the ring
+            transitions.fill(0)
+            for k in range(8):
+                transitions += neighbours[k] < neighbours[(k + 1) % 8]
+
+            if step == 0:
+                blocked = (p2 & p4 & p6) | (p4 & p6 & p8)
+            else:
+                blocked = (p2 & p4 & p8) | (p2 & p6 & p8)
+
+            delete = (center == 1) & (count >= 2) & (count <= 6) & (transitions == 1) & (blocked == 0)
+            removed += np.count_nonzero(delete)
+            center[delete] = 0
+
+        if removed == 0:
+            break
+
+    return center * np.uint8(255)
+
+def guo_hall_thinning(binary, max_iterations=200):
+    """Vectorized Guo-Hall thinning (same buffer layout as zhang_suen_thinning)"""
+    padded = _padded_ridges(binary)
+    center = padded[1:-1, 1:-1]
+    p2, p3, p4, p5, p6, p7, p8, p9 = _neighbour_views(padded)
+
+    for _ in range(max_iterations):
+        removed = 0
+        for step in (0, 1):
+            c = ((p2 ^ 1) & (p3 | p4)) + ((p4 ^ 1) & (p5 | p6)) + \
+                ((p6 ^ 1) & (p7 | p8)) + ((p8 ^ 1) & (p9 | p2))
+            n1 = (p9 | p2) + (p3 | p4) + (p5 | p6) + (p7 | p8)
+            n2 = (p2 | p3) + (p4 | p5) + (p6 | p7) + (p8 | p9)
+            n = np.minimum(n1, n2)
+
+            if step == 0:
+                m = (p6 | p7 | (p9 ^ 1)) & p8
+            else:
+                m = (p2 | p3 | (p5 ^ 1)) & p4
+
+            delete = (center == 1) & (c == 1) & (n >= 2) & (n <= 3) & (m == 0)
+            removed += np.count_nonzero(delete)
+            center[delete] = 0
+
+        if removed == 0:
+            break
+
+    return center * np.uint8(255)
+
+def skeleton_connectivity(skel):
+    """
+    Summarize how well a skeleton preserves ridge structure
+
+    Returns:
+        dict with ridge pixel count, 8-connected component count, crossing
+        number endings/bifurcations and the number of 2x2 blocks that are
+        fully set (i.e. places where the skeleton is still thicker than 1px)
+    """
+    from modules.fingerprint_recognition import crossing_number_map
+
+    ridge = (skel > 0).astype(np.uint8)
+    components, _ = cv2.connectedComponents(ridge, connectivity=8)
+    crossing = crossing_number_map(ridge * np.uint8(255))
+    thick = ridge[:-1, :-1] & ridge[1:, :-1] & ridge[:-1, 1:] & ridge[1:, 1:]
+
+    return {
+        'ridge_pixels': int(ridge.sum()),
+        'components': int(components - 1),
+        'endings': int(np.count_nonzero(crossing == 1)),
+        'bifurcations': int(np.count_nonzero(crossing == 3)),
+        'thick_blocks': int(thick.sum())
+    }
+
+def compare_thinning_methods(binary, methods=THINNING_METHODS, repeats=3):
+    """
+    Time each thinning algorithm on the same binary image and report
+    connectivity statistics for its skeleton
+
+    Returns:
+        dict mapping method name to its stats plus 'time_ms' (best of repeats)
+    """
+    report = {}
+    for method in methods:
+        best = float('inf')
+        for _ in range(repeats):
+            start = time.perf_counter()
+            skel = skeletonize(binary, method)
+            best = min(best, time.perf_counter() - start)
+
+        stats = skeleton_connectivity(skel)
+        stats['time_ms'] = round(best * 1000, 3)
+        report[method] = stats
+
+    return report
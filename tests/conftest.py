@@ -0,0 +1,15 @@
+import pytest
+
+import modules.template_store as template_store
+import modules.fingerprint_recognition as fingerprint_recognition
+from modules.template_cache import TemplateCache
+from modules.template_store import TemplateStore
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """Empty template store (and template cache) standing in for the process-wide ones"""
+    store = TemplateStore(str(tmp_path / "users.db"))
+    monkeypatch.setattr(template_store, "_default_store", store)
+    monkeypatch.setattr(fingerprint_recognition, "template_cache", TemplateCache())
+    yield store
+    store.close()
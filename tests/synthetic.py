@@ -0,0 +1,34 @@
+import cv2
+import numpy as np
+
+def synthetic_fingerprint(seed, size=320, wavelength=9, singularities=24, angle=0.0, shift=(0, 0), noise=8.0,
+                          impression=0):
+    """
+    Grayscale ridge pattern with real ridge endings and bifurcations
+
+    Ridges follow a wavy carrier; every phase singularity (a +/-2pi
+    spiral term at a random point) splits or ends one ridge, so the same
+    seed always yields the same finger. The print is rendered oversized,
+    rotated by angle (degrees) and shifted about its centre, then cropped,
+    so a different angle/shift of the same seed is a genuine impression.
+    Sensor noise is drawn per impression.
+    """
+    rng = np.random.default_rng(seed)
+    big = int(size * 1.5)
+    y, x = np.mgrid[0:big, 0:big].astype(np.float32) - big / 2
+
+    direction = rng.uniform(0, np.pi)
+    u = x * np.cos(direction) + y * np.sin(direction)
+    v = -x * np.sin(direction) + y * np.cos(direction)
+    bend, period = rng.uniform(8, 16), rng.uniform(40, 80)
+    phase = (u + bend * np.sin(v / period)) * 2 * np.pi / wavelength
+    for px, py in rng.uniform(-size / 2, size / 2, (singularities, 2)):
+        phase += rng.choice([-1, 1]) * np.arctan2(y - py, x - px)
+
+    image = (127 + 100 * np.cos(phase)).astype(np.float32)
+
+    matrix = cv2.getRotationMatrix2D((big / 2, big / 2), angle, 1.0)
+    matrix[:, 2] += np.asarray(shift, np.float32) - (big - size) / 2
+    rendered = cv2.warpAffine(image, matrix, (size, size), borderValue=127)
+    rendered += np.random.default_rng((seed, impression)).normal(0, noise, rendered.shape).astype(np.float32)
+    return np.clip(rendered, 0, 255).astype(np.uint8)
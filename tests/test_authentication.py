@@ -0,0 +1,102 @@
+import threading
+import concurrent.futures
+import time
+import pytest
+
+from modules import authentication
+from modules.settings import AUTH_FACTOR_COST_MS
+
+FACE_SECONDS = 0.05
+FINGERPRINT_SECONDS = 0.2
+
+class Calls(list):
+    """Names of the stub verifiers called, plus the most that ran at once"""
+
+    def __init__(self):
+        super().__init__()
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def run(self, name, seconds):
+        with self._lock:
+            self.append(name)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(seconds)
+        with self._lock:
+            self.active -= 1
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Stub verifiers that record every call; an input of 'match' (or 'password') passes"""
+    record = Calls()
+
+    def verify_face(face_img, threshold, user_id):
+        record.run('face', FACE_SECONDS)
+        return face_img == 'match', 0.9 if face_img == 'match' else 0.1
+
+    def verify_fingerprint(fingerprint_img, threshold, user_id, return_details):
+        record.run('fingerprint', FINGERPRINT_SECONDS)
+        return fingerprint_img == 'match', 0.5 if fingerprint_img == 'match' else 0.0, {}
+
+    def verify_password(password):
+        record.run('password', 0)
+        return password == 'password'
+
+    monkeypatch.setattr(authentication, 'verify_face', verify_face)
+    monkeypatch.setattr(authentication, 'verify_fingerprint', verify_fingerprint)
+    monkeypatch.setattr(authentication, 'verify_password', verify_password)
+    monkeypatch.setattr(authentication, '_expected_cost', dict(AUTH_FACTOR_COST_MS))
+    return record
+
+def test_defaults_overlap_biometrics_and_stop_without_waiting(calls):
+    start = time.perf_counter()
+    result = authentication.authenticate_user('match', 'match', 'password')
+    elapsed = time.perf_counter() - start
+
+    assert result['authenticated']
+    assert result['factors_skipped'] == ['fingerprint']
+    assert result['metrics']['decided_by'] == 'face'
+    assert calls.max_active >= 2
+    assert elapsed < FINGERPRINT_SECONDS
+
+def test_sequential_skipped_factor_never_runs(calls):
+    result = authentication.authenticate_user('match', 'match', 'password', parallel=False, early_stop=True)
+
+    assert result['authenticated']
+    assert result['factors_skipped'] == ['fingerprint']
+    assert result['metrics']['decided_by'] == 'face'
+    assert sorted(calls) == ['face', 'password']
+    assert calls.max_active == 1
+
+@pytest.mark.parametrize("parallel", [True, False])
+def test_failure_under_require_all_decides_immediately(calls, parallel):
+    result = authentication.authenticate_user('match', 'match', 'wrong', require_all=True,
+                                              parallel=parallel, early_stop=True)
+
+    assert not result['authenticated']
+    assert result['factors_skipped'] == ['face', 'fingerprint']
+    assert result['metrics']['decided_by'] == 'password'
+    assert result['metrics']['timings_ms']['total'] < FACE_SECONDS * 1000
+
+def test_decided_by_with_factors_finishing_together(calls, monkeypatch):
+    # Every factor comes back from a single wait(): password cannot decide in
+    # biometric mode, face (scheduled before fingerprint) is what settles it
+    monkeypatch.setattr(authentication, 'wait', lambda futures, return_when: concurrent.futures.wait(futures))
+    result = authentication.authenticate_user('match', 'match', 'password', parallel=True, early_stop=True)
+
+    assert result['authenticated']
+    assert result['factors_passed'] == ['face', 'fingerprint', 'password']
+    assert result['factors_skipped'] == []
+    outcomes, decided_by = authentication._run_parallel(
+        ['password', 'face', 'fingerprint'], {'password': 'password', 'face': 'match', 'fingerprint': 'match'},
+        'default_user', lambda outcomes: authentication._decided(outcomes, False, True))
+    assert decided_by == 'face'
+
+def test_without_early_stop_everything_runs(calls):
+    result = authentication.authenticate_user('match', 'match', 'password', parallel=True, early_stop=False)
+
+    assert result['factors_passed'] == ['face', 'fingerprint', 'password']
+    assert sorted(calls) == ['face', 'fingerprint', 'password']
+    assert calls.max_active >= 2
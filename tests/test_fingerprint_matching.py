@@ -0,0 +1,95 @@
+import pytest
+
+import modules.template_store as template_store
+import modules.fingerprint_recognition as fingerprint_recognition
+from modules.fingerprint_recognition import extract_fingerprint_features
+from modules.fingerprint_template import (prepare_template, serialize_template, deserialize_prepared_template,
+                                          ExtractionSettings, LEGACY_EXTRACTION)
+from modules.minutiae_matching import align_and_match
+from modules.settings import FINGERPRINT_THRESHOLD, FINGERPRINT_ALIGNMENT_HYPOTHESES
+from modules.template_store import FINGERPRINT
+from tests.synthetic import synthetic_fingerprint
+
+SEEDS = range(6)
+
+def probe_image(seed):
+    """A second impression of the finger: rotated, shifted, fresh sensor noise"""
+    return synthetic_fingerprint(seed, angle=8, shift=(10, -6), impression=1)
+
+def test_default_extraction_prunes_a_thin_skeleton():
+    extraction = fingerprint_recognition.current_extraction()
+    assert extraction.thinning_method == 'guo_hall'
+    assert extraction.pruned
+
+def test_genuine_scores_above_threshold_impostors_below():
+    enrolled = {seed: prepare_template(extract_fingerprint_features(synthetic_fingerprint(seed))['minutiae'])
+                for seed in SEEDS}
+    probes = {seed: extract_fingerprint_features(probe_image(seed))['minutiae'] for seed in SEEDS}
+
+    genuine, impostor = [], []
+    for owner, template in enrolled.items():
+        for seed, probe in probes.items():
+            score = align_and_match(template.minutiae, probe, max_hypotheses=FINGERPRINT_ALIGNMENT_HYPOTHESES,
+                                    index=template.index)['score']
+            (genuine if seed == owner else impostor).append(score)
+
+    assert min(genuine) >= FINGERPRINT_THRESHOLD > max(impostor)
+
+def test_morphological_skeleton_is_never_pruned():
+    image = synthetic_fingerprint(0)
+    features = extract_fingerprint_features(image, 'morphological', prune=True)
+    assert (features['extraction'].thinning_method, features['extraction'].pruned) == ('morphological', False)
+    assert features['stats']['minutiae_pruned'] == 0
+    assert len(features['minutiae']) == len(extract_fingerprint_features(image, 'morphological', prune=False)['minutiae'])
+
+@pytest.mark.parametrize("method", ['zhang_suen', 'guo_hall'])
+def test_pruning_keeps_most_minutiae_of_thin_skeletons(method):
+    image = synthetic_fingerprint(0)
+    unpruned = extract_fingerprint_features(image, method, prune=False)['stats']['minutiae']
+    pruned = extract_fingerprint_features(image, method, prune=True)
+    assert (pruned['extraction'].thinning_method, pruned['extraction'].pruned) == (method, True)
+    assert pruned['stats']['minutiae'] >= 0.8 * unpruned
+
+def test_template_records_extraction_settings():
+    features = extract_fingerprint_features(synthetic_fingerprint(0), 'zhang_suen', segment=False, enhancement='gabor')
+    data = serialize_template(prepare_template(features['minutiae'], extraction=features['extraction']))
+    assert deserialize_prepared_template(data).extraction == ('zhang_suen', True, 'gabor', False)
+    assert deserialize_prepared_template(serialize_template(features['minutiae'])).extraction is None
+
+def use_extraction(monkeypatch, extraction):
+    """Make extraction the current configuration"""
+    monkeypatch.setattr(fingerprint_recognition, "FINGERPRINT_THINNING_METHOD", extraction.thinning_method)
+    monkeypatch.setattr(fingerprint_recognition, "FINGERPRINT_PRUNING", extraction.pruned)
+    monkeypatch.setattr(fingerprint_recognition, "FINGERPRINT_ENHANCEMENT", extraction.enhancement)
+    monkeypatch.setattr(fingerprint_recognition, "FINGERPRINT_SEGMENTATION", extraction.segmented)
+
+def test_probe_is_extracted_like_the_template(store, monkeypatch):
+    enrolled = ExtractionSettings('guo_hall', True, 'gabor', False)
+    use_extraction(monkeypatch, enrolled)
+    monkeypatch.setattr(fingerprint_recognition, "index_fingerprint_template", lambda user_id, minutiae: None)
+    fingerprint_recognition.save_fingerprint_template(synthetic_fingerprint(1), "alice")
+
+    use_extraction(monkeypatch, ExtractionSettings('morphological', False, 'adaptive', True))
+    passed, score, details = fingerprint_recognition.verify_fingerprint(
+        probe_image(1), threshold=FINGERPRINT_THRESHOLD, user_id="alice", return_details=True)
+    assert details['extraction_settings'] == enrolled
+    assert details['reenroll']
+    assert passed
+
+def test_reenrollment_only_flagged_when_settings_differ(store, monkeypatch):
+    minutiae = fingerprint_recognition._extract_like(synthetic_fingerprint(1), LEGACY_EXTRACTION)['minutiae']
+    store.put("alice", FINGERPRINT, serialize_template(minutiae))
+
+    use_extraction(monkeypatch, LEGACY_EXTRACTION)
+    _, _, details = fingerprint_recognition.verify_fingerprint(
+        probe_image(1), threshold=FINGERPRINT_THRESHOLD, user_id="alice", return_details=True)
+    assert details['extraction_settings'] == LEGACY_EXTRACTION
+    assert not details['reenroll']
+    assert template_store.template_statistics(store)['reenroll'] == []
+
+    use_extraction(monkeypatch, LEGACY_EXTRACTION._replace(thinning_method='guo_hall', pruned=True))
+    _, _, details = fingerprint_recognition.verify_fingerprint(
+        probe_image(1), threshold=FINGERPRINT_THRESHOLD, user_id="alice", return_details=True)
+    assert details['extraction_settings'] == LEGACY_EXTRACTION
+    assert details['reenroll']
+    assert template_store.template_statistics(store)['reenroll'] == ["alice"]
@@ -0,0 +1,16 @@
+import numpy as np
+
+from modules.liveness_detection import check_liveness
+
+def test_check_liveness_returns_timings_with_details():
+    image = np.random.default_rng(0).integers(0, 256, (240, 320, 3), dtype=np.uint8)
+    is_live, details = check_liveness(image, enable_blink=False, enable_depth=False, return_details=True)
+
+    assert is_live == details['is_live']
+    assert set(details['timings_ms']) == {'texture'}
+    assert details['timings_ms']['texture'] >= 0
+    assert 0.0 <= details['overall_score'] <= 1.0
+
+def test_check_liveness_returns_bool_by_default():
+    image = np.full((240, 320, 3), 127, np.uint8)
+    assert check_liveness(image, enable_blink=False, enable_depth=False) is False
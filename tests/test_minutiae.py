@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from modules.fingerprint_recognition import crossing_number_map, detect_crossing_numbers, enhance_fingerprint
+from modules.thinning import skeletonize, THINNING_METHODS
+from tests.synthetic import synthetic_fingerprint
+
+def reference_crossing_numbers(skel):
+    """The original per-pixel crossing-number loop: [(row, col, cn)] in scan order"""
+    found = []
+    h, w = skel.shape
+    for i in range(1, h - 1):
+        for j in range(1, w - 1):
+            if skel[i, j] == 255:
+                neighbors = [
+                    skel[i-1, j], skel[i-1, j+1], skel[i, j+1], skel[i+1, j+1],
+                    skel[i+1, j], skel[i+1, j-1], skel[i, j-1], skel[i-1, j-1]
+                ]
+                cn = 0
+                for k in range(8):
+                    cn += abs(int(neighbors[k] // 255) - int(neighbors[(k+1) % 8] // 255))
+                cn = cn // 2
+                if cn == 1 or cn == 3:
+                    found.append((i, j, cn))
+    return found
+
+def vectorized_crossing_numbers(skel):
+    rows, cols, crossing = detect_crossing_numbers(skel)
+    return list(zip(rows.tolist(), cols.tolist(), crossing.tolist()))
+
+@pytest.mark.parametrize("method", THINNING_METHODS)
+def test_matches_reference_on_real_skeleton(method):
+    skel = skeletonize(enhance_fingerprint(synthetic_fingerprint(3, size=200), 'adaptive'), method)
+    expected = reference_crossing_numbers(skel)
+    assert expected
+    assert vectorized_crossing_numbers(skel) == expected
+
+def test_matches_reference_on_random_patterns():
+    rng = np.random.default_rng(0)
+    for density in (0.1, 0.3, 0.5):
+        skel = np.where(rng.random((40, 57)) < density, 255, 0).astype(np.uint8)
+        assert vectorized_crossing_numbers(skel) == reference_crossing_numbers(skel)
+
+def test_ridges_touching_the_border():
+    skel = np.zeros((12, 12), np.uint8)
+    skel[0, :] = 255          # along the top edge: never reported
+    skel[5, 0:7] = 255        # runs into the left edge, ends inside
+    skel[:, 11] = 255         # along the right edge
+    skel[3:12, 8] = 255       # runs into the bottom edge
+    expected = reference_crossing_numbers(skel)
+    assert vectorized_crossing_numbers(skel) == expected
+    assert (5, 6, 1) in expected
+
+def test_ending_and_bifurcation_types():
+    skel = np.zeros((9, 9), np.uint8)
+    skel[4, 1:8] = 255
+    skel[1:4, 4] = 255
+    assert vectorized_crossing_numbers(skel) == reference_crossing_numbers(skel)
+    assert {(r, c): cn for r, c, cn in vectorized_crossing_numbers(skel)} == {(4, 1): 1, (4, 7): 1, (1, 4): 1, (4, 4): 3}
+
+@pytest.mark.parametrize("shape", [(0, 0), (1, 1), (2, 5), (5, 2), (3, 3)])
+def test_tiny_images(shape):
+    skel = np.full(shape, 255, np.uint8)
+    assert crossing_number_map(skel).shape == shape
+    assert vectorized_crossing_numbers(skel) == reference_crossing_numbers(skel)
+
+def test_only_255_counts_as_ridge():
+    skel = np.zeros((7, 7), np.uint8)
+    skel[3, 1:6] = 255
+    skel[3, 3] = 128
+    skel[1, 1:6] = 1
+    assert vectorized_crossing_numbers(skel) == reference_crossing_numbers(skel)
@@ -0,0 +1,43 @@
+import numpy as np
+
+import modules.fingerprint_recognition as fingerprint_recognition
+from modules.fingerprint_template import serialize_template
+from modules.minutiae_matching import MINUTIAE_DTYPE
+from modules.template_store import FINGERPRINT
+
+def minutiae(n, seed):
+    rng = np.random.default_rng(seed)
+    records = np.empty(n, dtype=MINUTIAE_DTYPE)
+    records['x'] = rng.integers(0, 300, n)
+    records['y'] = rng.integers(0, 300, n)
+    records['type'] = rng.choice([1, 3], n)
+    records['angle'] = rng.uniform(-np.pi, np.pi, n)
+    return records
+
+def test_unrelated_write_keeps_cached_template(store):
+    store.put("alice", FINGERPRINT, serialize_template(minutiae(40, 0)))
+    first = fingerprint_recognition.load_prepared_template("alice")
+
+    store.put("bob", FINGERPRINT, serialize_template(minutiae(40, 1)))
+    assert fingerprint_recognition.load_prepared_template("alice") is first
+
+    stats = fingerprint_recognition.template_cache.stats()
+    assert (stats['misses'], stats['hits'], stats['invalidations']) == (1, 1, 0)
+
+def test_rewritten_template_is_reloaded(store):
+    store.put("alice", FINGERPRINT, serialize_template(minutiae(40, 0)))
+    fingerprint_recognition.load_prepared_template("alice")
+
+    store.put("alice", FINGERPRINT, serialize_template(minutiae(25, 2)))
+    assert len(fingerprint_recognition.load_prepared_template("alice")) == 25
+
+def test_old_format_is_upgraded_once_and_stays_cached(store):
+    records = minutiae(40, 0)
+    legacy = serialize_template(records)
+    legacy = legacy[:4] + np.uint16(1).tobytes() + legacy[6:]  # version 1 header, v2 payload ignored
+    store.put("alice", FINGERPRINT, legacy)
+
+    upgraded = fingerprint_recognition.load_prepared_template("alice")
+    assert upgraded.version == fingerprint_recognition.TEMPLATE_VERSION
+    assert fingerprint_recognition.load_prepared_template("alice") is upgraded
+    assert fingerprint_recognition.template_cache.stats()['hits'] == 1